@@ -0,0 +1,282 @@
+import gzip
+import json
+import os
+import stat
+import tarfile
+import time
+import zipfile
+import zlib
+from typing import IO, TYPE_CHECKING, BinaryIO, cast
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsRead
+
+# индекс tar.gz лежит рядом с архивом: archive.tar.gz.idx
+INDEX_SUFFIX = ".idx"
+
+INDEX_VERSION = 1
+
+# сколько сжатых данных читается за раз при сканировании
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def member_name(name: str) -> str:
+    """Имя члена архива без ./ в начале и / в конце"""
+    name = os.path.normpath(name).replace(os.sep, "/")
+    return "" if name == "." else name
+
+
+def member_mode(member: tarfile.TarInfo) -> int:
+    """Права и тип члена tar в виде st_mode"""
+    if member.isdir():
+        kind = stat.S_IFDIR
+    elif member.issym():
+        kind = stat.S_IFLNK
+    else:
+        kind = stat.S_IFREG
+    return kind | member.mode
+
+
+def member_stat(mode: int, size: int, mtime: float) -> os.stat_result:
+    """stat для члена архива, чтобы выводить его как файл"""
+    return os.stat_result((mode, 0, 0, 0, 0, 0, size, mtime, mtime, mtime))
+
+
+def zip_members(archive: str) -> list[tuple[str, os.stat_result]]:
+    """Члены zip по центральному каталогу, без распаковки данных"""
+    result = []
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            mode = info.external_attr >> 16
+            if not mode:
+                mode = stat.S_IFDIR | 0o755 if info.is_dir() else stat.S_IFREG | 0o644
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            result.append(
+                (member_name(info.filename), member_stat(mode, info.file_size, mtime))
+            )
+    return result
+
+
+def zip_extract(archive: str, name: str, destination: str) -> int:
+    """Распаковывает один файл zip, читая только его данные"""
+    with zipfile.ZipFile(archive) as zf:
+        try:
+            info = zf.getinfo(name)
+        except KeyError:
+            raise Exception(f"No such member in archive: {name}")
+        if info.is_dir():
+            raise Exception(f"Not a regular file in archive: {name}")
+        with zf.open(info) as src, open(destination, "wb") as dst:
+            while chunk := src.read(SCAN_CHUNK_SIZE):
+                dst.write(chunk)
+
+    mode = (info.external_attr >> 16) & 0o7777
+    if mode:
+        os.chmod(destination, mode)
+    return info.file_size
+
+
+class IndexedTarFile(tarfile.TarFile):
+    """tar, который запоминает смещение заголовка каждого члена"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Как у TarFile"""
+        # имя -> [смещение заголовка, размер, mtime, st_mode]
+        self.index_members: dict[str, list] = {}
+        super().__init__(*args, **kwargs)
+
+    def addfile(
+        self, tarinfo: tarfile.TarInfo, fileobj: "SupportsRead[bytes] | None" = None
+    ) -> None:
+        """Записывает член, запоминая, где начинается его заголовок"""
+        self.index_members[member_name(tarinfo.name)] = [
+            self.offset,
+            tarinfo.size,
+            tarinfo.mtime,
+            member_mode(tarinfo),
+        ]
+        super().addfile(tarinfo, fileobj)
+
+
+class BlockReader:
+    """Распаковывает gzip из нескольких членов, запоминая начало каждого"""
+
+    def __init__(self, f: BinaryIO) -> None:
+        """Сжатый файл, открытый на чтение с начала"""
+        self._file = f
+        # (смещение члена gzip в файле, смещение его данных в потоке)
+        self.blocks: list[tuple[int, int]] = []
+        self._decompressor: "zlib._Decompress | None" = None
+        self._pending = bytearray()
+        self._position = 0
+        self._produced = 0
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        """Читает распакованные данные"""
+        while (size < 0 or len(self._pending) < size) and not self._eof:
+            self.fill()
+        if size < 0:
+            size = len(self._pending)
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def fill(self) -> None:
+        """Распаковывает очередную порцию сжатых данных"""
+        if self._decompressor is None or self._decompressor.eof:
+            data = self._decompressor.unused_data if self._decompressor else b""
+            start = self._position - len(data)
+            if not data:
+                data = self._file.read(SCAN_CHUNK_SIZE)
+                self._position += len(data)
+            # после последнего члена могут идти нулевые байты выравнивания
+            if not data.strip(b"\0"):
+                self._eof = True
+                return
+            self.blocks.append((start, self._produced))
+            self._decompressor = zlib.decompressobj(31)
+        else:
+            data = self._file.read(SCAN_CHUNK_SIZE)
+            self._position += len(data)
+            if not data:
+                raise Exception("Compressed file ended before the end of the stream")
+
+        output = self._decompressor.decompress(data)
+        self._produced += len(output)
+        self._pending += output
+
+
+class TarIndex:
+    """Индекс tar.gz: где начинаются члены gzip и заголовки членов tar
+
+    Зная смещения, один член архива можно распаковать, начав с ближайшего
+    члена gzip, а не с начала файла.
+    """
+
+    def __init__(self, archive: str) -> None:
+        """Архив, индекс которого читается или строится"""
+        self.archive = archive
+        self.path = archive + INDEX_SUFFIX
+        self.blocks: list[tuple[int, int]] = []
+        # имя -> [смещение заголовка, размер, mtime, st_mode]
+        self.members: dict[str, list] = {}
+
+    @classmethod
+    def for_archive(cls, archive: str, save: bool = True) -> "TarIndex":
+        """Индекс из файла рядом с архивом, если его нет - сканирует архив
+
+        С save=False построенный индекс не записывается, так архив можно
+        смотреть, ничего не меняя рядом с ним.
+        """
+        index = cls(archive)
+        if not index.load():
+            index.scan()
+            if not save:
+                return index
+            try:
+                index.save()
+            except OSError:
+                # индекс не сохранить, например, рядом с архивом нельзя писать
+                pass
+        return index
+
+    def load(self) -> bool:
+        """Читает индекс, False если его нет или архив с тех пор менялся"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            info = os.stat(self.archive)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("version") != INDEX_VERSION or data.get("archive") != [
+            info.st_size,
+            info.st_mtime_ns,
+        ]:
+            return False
+        self.blocks = [tuple(block) for block in data["blocks"]]
+        self.members = data["members"]
+        return True
+
+    def save(self) -> None:
+        """Атомарно записывает индекс рядом с архивом"""
+        info = os.stat(self.archive)
+        data = {
+            "version": INDEX_VERSION,
+            "archive": [info.st_size, info.st_mtime_ns],
+            "blocks": self.blocks,
+            "members": self.members,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def scan(self) -> None:
+        """Строит индекс одним проходом по архиву"""
+        self.members = {}
+        with open(self.archive, "rb") as f:
+            reader = BlockReader(f)
+            # потоковому режиму хватает read, IO[bytes] нужен только для типов
+            with tarfile.open(fileobj=cast(IO[bytes], reader), mode="r|") as tar:
+                # член начинается там, где кончился предыдущий: так в смещение
+                # попадают и расширенные заголовки pax перед ним
+                offset = 0
+                while (member := tar.next()) is not None:
+                    self.members[member_name(member.name)] = [
+                        offset,
+                        member.size,
+                        member.mtime,
+                        member_mode(member),
+                    ]
+                    offset = tar.offset
+        self.blocks = reader.blocks
+
+    def list(self) -> list[tuple[str, os.stat_result]]:
+        """Члены архива"""
+        return [
+            (name, member_stat(mode, size, mtime))
+            for name, (_, size, mtime, mode) in self.members.items()
+            if name
+        ]
+
+    def extract(self, name: str, destination: str) -> int:
+        """Распаковывает один файл, начиная с ближайшего члена gzip"""
+        record = self.members.get(member_name(name))
+        if record is None:
+            raise Exception(f"No such member in archive: {name}")
+        offset, size, mtime, mode = record
+        if not stat.S_ISREG(mode):
+            raise Exception(f"Not a regular file in archive: {name}")
+
+        # последний член gzip, начинающийся не позже заголовка
+        block_offset, data_offset = max(
+            (block for block in self.blocks if block[1] <= offset),
+            key=lambda block: block[1],
+            default=(0, 0),
+        )
+        with open(self.archive, "rb") as f:
+            f.seek(block_offset)
+            with gzip.GzipFile(fileobj=f) as gz:
+                skip = offset - data_offset
+                while skip:
+                    skipped = len(gz.read(min(skip, SCAN_CHUNK_SIZE)))
+                    if not skipped:
+                        raise Exception(f"Archive index is out of date: {self.path}")
+                    skip -= skipped
+
+                with tarfile.open(fileobj=gz, mode="r|") as tar:
+                    member = tar.next()
+                    if member is None or member_name(member.name) != member_name(name):
+                        raise Exception(f"Archive index is out of date: {self.path}")
+                    source = tar.extractfile(member)
+                    if source is None:
+                        raise Exception(f"Archive index is out of date: {self.path}")
+                    with open(destination, "wb") as dst:
+                        while chunk := source.read(SCAN_CHUNK_SIZE):
+                            dst.write(chunk)
+
+        os.chmod(destination, mode & 0o7777)
+        os.utime(destination, (mtime, mtime))
+        return size
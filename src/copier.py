@@ -0,0 +1,144 @@
+import os
+import shutil
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+# ioctl клонирования файла (reflink) в Linux
+FICLONE = 0x40049409
+
+# сколько файлов копируется одновременно
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# как часто сообщаем о прогрессе, секунды
+PROGRESS_INTERVAL = 0.5
+
+
+class TreeCopier:
+    """Копирование дерева директорий пулом потоков"""
+
+    def __init__(
+        self,
+        workers: int = COPY_WORKERS,
+        progress: Callable[[int, int], None] | None = None,
+    ) -> None:
+        """Число потоков и обработчик прогресса (файлы, байты)"""
+        self.workers = workers
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        # устройства, на которых reflink не поддерживается
+        self._no_reflink: set[int] = set()
+
+    def copy_tree(self, source: str, destination: str) -> float:
+        """Копирует source в новую директорию destination, возвращает время"""
+        if os.path.exists(destination):
+            raise FileExistsError(f"File exists: {destination}")
+
+        started = time.monotonic()
+        last_report = started
+        errors: list[str] = []
+        directories: list[tuple[str, str]] = []
+        pending: set[Future] = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # обход сверху вниз: родительская директория создается раньше детей
+            for path, dirs, files in os.walk(source):
+                rel = os.path.relpath(path, source)
+                if rel == ".":
+                    target_dir = destination
+                    os.makedirs(target_dir)
+                else:
+                    target_dir = os.path.join(destination, rel)
+                    os.mkdir(target_dir)
+                directories.append((path, target_dir))
+
+                for name in list(dirs):
+                    link = os.path.join(path, name)
+                    if os.path.islink(link):
+                        # ссылки на директории переносим как ссылки
+                        os.symlink(os.readlink(link), os.path.join(target_dir, name))
+                        dirs.remove(name)
+
+                for name in files:
+                    src = os.path.join(path, name)
+                    dst = os.path.join(target_dir, name)
+                    pending.add(executor.submit(self.copy_file, src, dst))
+
+                # не копим неограниченное число задач
+                while len(pending) > self.workers * 8:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.collect(done, errors)
+                    last_report = self.report(last_report)
+
+            while pending:
+                done, pending = wait(
+                    pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                self.collect(done, errors)
+                last_report = self.report(last_report)
+
+        # права и время директорий выставляем снизу вверх, после файлов
+        for path, target_dir in reversed(directories):
+            try:
+                shutil.copystat(path, target_dir)
+            except OSError as e:
+                errors.append(str(e))
+
+        if errors:
+            raise Exception("; ".join(errors[:3]))
+
+        if self.progress:
+            self.progress(self.files, self.bytes)
+        return time.monotonic() - started
+
+    def collect(self, done: set[Future], errors: list[str]) -> None:
+        """Собирает ошибки завершившихся задач"""
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                errors.append(str(error))
+
+    def report(self, last_report: float) -> float:
+        """Сообщает о прогрессе не чаще PROGRESS_INTERVAL"""
+        now = time.monotonic()
+        if self.progress and now - last_report >= PROGRESS_INTERVAL:
+            self.progress(self.files, self.bytes)
+            return now
+        return last_report
+
+    def copy_file(self, src: str, dst: str) -> None:
+        """Копирует один файл: reflink, если можно, иначе копирование ядром"""
+        info = os.stat(src)
+        if not self.clone_file(src, dst, info):
+            # copyfile сам использует sendfile/copy_file_range там, где они есть
+            shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+
+        with self._lock:
+            self.files += 1
+            self.bytes += info.st_size
+
+    def clone_file(self, src: str, dst: str, info: os.stat_result) -> bool:
+        """Клонирует файл без копирования данных, если это умеет файловая система"""
+        if fcntl is None or info.st_dev in self._no_reflink or not info.st_size:
+            return False
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                self._no_reflink.add(info.st_dev)
+                return False
+            # убеждаемся, что данные действительно появились
+            if os.fstat(fdst.fileno()).st_size != info.st_size:
+                self._no_reflink.add(info.st_dev)
+                return False
+        return True
@@ -0,0 +1,221 @@
+import gzip
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from src.copier import COPY_WORKERS, PROGRESS_INTERVAL
+
+# размер блока при записи распакованных данных
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+# место под файлы меньше блока заранее не выделяем: выигрыша нет
+PREALLOCATE_MIN_SIZE = EXTRACT_CHUNK_SIZE
+
+
+def preallocate(fd: int, size: int) -> None:
+    """Выделяет место под файл заранее, если файловая система это умеет"""
+    if size < PREALLOCATE_MIN_SIZE or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        # например, tmpfs старых ядер или сетевая файловая система
+        pass
+
+
+def safe_path(root: str, name: str) -> str:
+    """Путь распаковки члена архива, не выходящий за пределы root"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.isabs(name) or os.path.commonpath([root, path]) != root:
+        raise Exception(f"Unsafe path in archive: {name}")
+    return path
+
+
+class Extractor:
+    """Распаковка архивов: tar потоком, zip пулом потоков"""
+
+    def __init__(
+        self,
+        # распаковка zip, как и копирование, упирается в запись файлов
+        workers: int = COPY_WORKERS,
+        progress: Callable[[int, int], None] | None = None,
+    ) -> None:
+        """Число потоков и обработчик прогресса (файлы, байты)"""
+        self.workers = workers
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+
+    def extract_tar(
+        self,
+        archive: str,
+        destination: str,
+        metadata: str | None = None,
+        on_metadata: Callable[[dict], None] | None = None,
+    ) -> float:
+        """Распаковывает tar.gz за один проход по потоку, возвращает время
+
+        Член архива с именем metadata не распаковывается: он читается как
+        JSON и передается в on_metadata в тот момент, когда до него дошел поток.
+        """
+        started = time.monotonic()
+        directories: list[tarfile.TarInfo] = []
+
+        # gzip из нескольких членов (как у tar) поток tarfile "r|gz" не читает
+        with gzip.open(archive) as gz, tarfile.open(fileobj=gz, mode="r|") as tar:
+            while (member := tar.next()) is not None:
+                if metadata and os.path.normpath(member.name) == metadata:
+                    if on_metadata is not None:
+                        source = tar.extractfile(member)
+                        if source is None:
+                            raise Exception(f"Bad metadata in archive: {member.name}")
+                        on_metadata(json.load(source))
+                    continue
+                try:
+                    member = tarfile.data_filter(member, destination)
+                except tarfile.FilterError:
+                    raise Exception(f"Unsafe path in archive: {member.name}")
+
+                if member.isfile():
+                    self.extract_tar_file(tar, member, destination)
+                    self.add(member.size)
+                    self.report()
+                else:
+                    # права и время директорий выставляем в конце, после файлов
+                    tar.extract(
+                        member,
+                        destination,
+                        set_attrs=not member.isdir(),
+                        filter="fully_trusted",
+                    )
+                    if member.isdir():
+                        directories.append(member)
+                # поток tarfile копит все прочитанные заголовки, а назад мы не ходим
+                tar.members.clear()  # type: ignore[attr-defined]
+
+            for member in reversed(directories):
+                path = os.path.join(destination, member.name)
+                tar.utime(member, path)
+                tar.chmod(member, path)
+
+        self.report(final=True)
+        return time.monotonic() - started
+
+    def extract_tar_file(
+        self, tar: tarfile.TarFile, member: tarfile.TarInfo, destination: str
+    ) -> None:
+        """Распаковывает обычный файл tar, место под него выделяется заранее"""
+        path = os.path.join(destination, member.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        source = tar.extractfile(member)
+        if source is None:
+            raise Exception(f"Bad file in archive: {member.name}")
+        with source, open(path, "wb") as dst:
+            preallocate(dst.fileno(), member.size)
+            shutil.copyfileobj(source, dst, EXTRACT_CHUNK_SIZE)
+
+        tar.chown(member, path, numeric_owner=False)
+        tar.chmod(member, path)
+        tar.utime(member, path)
+
+    def extract_zip(self, archive: str, destination: str) -> float:
+        """Распаковывает zip параллельно, у каждого потока свой дескриптор"""
+        started = time.monotonic()
+        with zipfile.ZipFile(archive) as zf:
+            members = zf.infolist()
+
+        # все имена проверяем до записи первого файла
+        targets = [
+            (member, safe_path(destination, member.filename)) for member in members
+        ]
+        for member, path in targets:
+            os.makedirs(
+                path if member.is_dir() else os.path.dirname(path), exist_ok=True
+            )
+
+        local = threading.local()
+        handles: list[zipfile.ZipFile] = []
+        errors: list[str] = []
+        pending: set[Future] = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for member, path in targets:
+                    if not member.is_dir():
+                        pending.add(
+                            executor.submit(
+                                self.extract_member,
+                                archive,
+                                member,
+                                path,
+                                local,
+                                handles,
+                            )
+                        )
+                while pending:
+                    done, pending = wait(
+                        pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED
+                    )
+                    for future in done:
+                        error = future.exception()
+                        if error is not None:
+                            errors.append(str(error))
+                    self.report()
+        finally:
+            for handle in handles:
+                handle.close()
+
+        if errors:
+            raise Exception("; ".join(errors[:3]))
+
+        self.report(final=True)
+        return time.monotonic() - started
+
+    def extract_member(
+        self,
+        archive: str,
+        member: zipfile.ZipInfo,
+        path: str,
+        local: threading.local,
+        handles: list[zipfile.ZipFile],
+    ) -> None:
+        """Распаковывает один файл zip"""
+        zf = getattr(local, "zip", None)
+        if zf is None:
+            # общий ZipFile переключал бы позицию между потоками под блокировкой
+            zf = local.zip = zipfile.ZipFile(archive)
+            with self._lock:
+                handles.append(zf)
+
+        with zf.open(member) as src, open(path, "wb") as dst:
+            # размер известен заранее: выделяем место сразу, а не по блокам
+            preallocate(dst.fileno(), member.file_size)
+            shutil.copyfileobj(src, dst, EXTRACT_CHUNK_SIZE)
+
+        mode = (member.external_attr >> 16) & 0o7777
+        if mode:
+            os.chmod(path, mode)
+        self.add(member.file_size)
+
+    def add(self, size: int) -> None:
+        """Учитывает распакованный файл"""
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+
+    def report(self, final: bool = False) -> None:
+        """Сообщает о прогрессе не чаще PROGRESS_INTERVAL"""
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if final or now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            self.progress(self.files, self.bytes)
@@ -0,0 +1,32 @@
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+# блокировка хранится рядом с файлом: path.lock
+LOCK_SUFFIX = ".lock"
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Блокирует файл path от изменения другими процессами оболочки
+
+    Блокировка берется на отдельном файле, поэтому переживает подмену
+    самого файла через os.replace. В одном процессе вложенно не берется.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + LOCK_SUFFIX, "ab") as lock:
+        # без fcntl (Windows) полагаемся на то, что оболочка одна
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
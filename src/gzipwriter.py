@@ -0,0 +1,99 @@
+import gzip
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# сколько блоков сжимается одновременно, общее для gzip и zip: zlib
+# отпускает GIL, поэтому хватает потоков
+COMPRESS_WORKERS = os.cpu_count() or 1
+
+# размер несжатого блока, который становится отдельным членом gzip
+GZIP_BLOCK_SIZE = 1024 * 1024
+
+
+class ParallelGzipWriter:
+    """Файл .gz из независимых членов gzip, которые сжимаются параллельно
+
+    Последовательность членов - обычный gzip (RFC 1952), ее читают gzip,
+    tar и модуль gzip. Каждый член распаковывается отдельно, поэтому
+    смещения блоков в blocks позволяют читать архив с середины.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        level: int = 6,
+        workers: int = COMPRESS_WORKERS,
+        block_size: int = GZIP_BLOCK_SIZE,
+    ) -> None:
+        """Путь файла, степень сжатия 0-9, число потоков и размер блока"""
+        if not 0 <= level <= 9:
+            raise Exception("Compression level must be between 0 and 9")
+        self.path = path
+        self.level = level
+        self.workers = workers
+        self.block_size = block_size
+        # (смещение члена в .gz, смещение его данных в несжатом потоке)
+        self.blocks: list[tuple[int, int]] = []
+        self._buffer = bytearray()
+        self._pending: deque[tuple[int, Future]] = deque()
+        self._offset = 0
+        self._data_offset = 0
+        self._mtime = int(time.time())
+        self._pool = ThreadPoolExecutor(workers)
+        self._out = open(path, "wb")
+
+    def write(self, data: bytes) -> int:
+        """Дописывает несжатые данные"""
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self.submit(bytes(self._buffer[: self.block_size]))
+            del self._buffer[: self.block_size]
+        return len(data)
+
+    def submit(self, block: bytes) -> None:
+        """Отдает блок пулу, дописывает уже сжатые по порядку"""
+        future = self._pool.submit(gzip.compress, block, self.level, mtime=self._mtime)
+        self._pending.append((len(block), future))
+        # ограничиваем число блоков в памяти
+        while len(self._pending) > self.workers * 2:
+            self.flush_block()
+
+    def flush_block(self) -> None:
+        """Записывает самый ранний сжатый блок"""
+        size, future = self._pending.popleft()
+        data = future.result()
+        self.blocks.append((self._offset, self._data_offset))
+        self._out.write(data)
+        self._offset += len(data)
+        self._data_offset += size
+
+    def close(self) -> None:
+        """Сжимает остаток и закрывает файл"""
+        if self._out.closed:
+            return
+        try:
+            if self._buffer:
+                self.submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self.flush_block()
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Останавливает пул и закрывает файл, не дописывая остаток"""
+        self._pool.shutdown(cancel_futures=True)
+        self._out.close()
+
+    def __enter__(self) -> "ParallelGzipWriter":
+        """Контекстный менеджер"""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Дописывает файл, при ошибке только закрывает его"""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
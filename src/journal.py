@@ -0,0 +1,596 @@
+import json
+import mmap
+import os
+import threading
+from array import array
+from collections.abc import Iterator
+from typing import BinaryIO
+
+from src.filelock import file_lock
+
+FSYNC_POLICIES = ("always", "batch", "exit")
+
+# сколько данных копим в буфере при политике exit
+MAX_BUFFER_BYTES = 64 * 1024
+
+# размер блока при досчитывании индекса
+SCAN_CHUNK = 1024 * 1024
+
+
+def file_id(info: os.stat_result) -> tuple[int, int]:
+    """Устройство и inode файла: по ним видно, что файл подменили"""
+    return info.st_dev, info.st_ino
+
+
+class HistoryJournal:
+    """Журнал истории команд с дозаписью в конец файла
+
+    Журнал могут одновременно дописывать несколько оболочек: дозапись и
+    индекс меняются под файловой блокировкой, а перед каждым обращением
+    индекс сверяется с настоящим размером файла.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fsync_policy: str = "batch",
+        batch_size: int = 16,
+        max_bytes: int = 1024 * 1024,
+    ) -> None:
+        """Настройка журнала и политики сброса на диск"""
+        if fsync_policy not in FSYNC_POLICIES:
+            raise Exception(f"Unknown fsync policy: {fsync_policy}")
+        if batch_size <= 0:
+            raise Exception("Batch size must be positive")
+
+        self.path = path
+        self.index_path = path + ".idx"
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+
+        self._buffer: list[bytes] = []
+        self._buffer_bytes = 0
+        self._file: BinaryIO | None = None
+        self._size: int | None = None
+        # (устройство, inode) файла, на который смотрят открытые дескрипторы
+        self._file_id: tuple[int, int] | None = None
+        self._lock = threading.Lock()
+        self._compactor: threading.Thread | None = None
+
+        # индекс: концы строк журнала, по 8 байт на запись
+        self._index_file: BinaryIO | None = None
+        self._count = 0
+        self._indexed: int | None = None
+
+        # отображение файла для чтения
+        self._reader: BinaryIO | None = None
+        self._map: mmap.mmap | None = None
+
+    def __len__(self) -> int:
+        """Количество команд в истории"""
+        with self._lock:
+            self._sync_index()
+            return self._count + len(self._buffer)
+
+    def tail(self, n: int) -> list[str]:
+        """Возвращает последние n команд, читая только их"""
+        with self._lock:
+            self._sync_index()
+            buffered = [
+                item.decode("utf-8", "replace").rstrip("\n") for item in self._buffer
+            ]
+            if n <= len(buffered):
+                return buffered[len(buffered) - n :]
+
+            from_file = min(n - len(buffered), self._count)
+            return self._read_entries(self._count - from_file, self._count) + buffered
+
+    def entries(self, start: int = 0) -> Iterator[str]:
+        """Перебирает команды начиная с номера start"""
+        step = 1024
+        position = start
+        while True:
+            with self._lock:
+                self._sync_index()
+                if position < self._count:
+                    end = min(position + step, self._count)
+                    batch = self._read_entries(position, end)
+                else:
+                    offset = position - self._count
+                    batch = [
+                        item.decode("utf-8", "replace").rstrip("\n")
+                        for item in self._buffer[offset : offset + step]
+                    ]
+            if not batch:
+                return
+            yield from batch
+            position += len(batch)
+
+    def append(self, line: str) -> None:
+        """Добавляет строку в журнал"""
+        data = (line.replace("\n", " ") + "\n").encode("utf-8")
+
+        with self._lock:
+            self._buffer.append(data)
+            self._buffer_bytes += len(data)
+
+            if self.fsync_policy == "always":
+                self._write_buffer(sync=True)
+            elif self.fsync_policy == "batch":
+                if len(self._buffer) >= self.batch_size:
+                    self._write_buffer(sync=True)
+            elif self._buffer_bytes >= MAX_BUFFER_BYTES:
+                self._write_buffer(sync=False)
+
+            need_compact = self._current_size() > self.max_bytes
+
+        if need_compact:
+            self.compact(wait=False)
+
+    def flush(self, sync: bool = True) -> None:
+        """Записывает буфер в файл"""
+        with self._lock:
+            self._write_buffer(sync)
+
+    def close(self) -> None:
+        """Сбрасывает буфер и закрывает файлы"""
+        if self._compactor is not None:
+            self._compactor.join()
+
+        with self._lock:
+            self._write_buffer(sync=True)
+            self._close_files()
+
+    def compact(self, wait: bool = True) -> None:
+        """Обрезает журнал до последних записей, укладывающихся в половину лимита"""
+        if self._compactor is not None and self._compactor.is_alive():
+            if wait:
+                self._compactor.join()
+            return
+
+        self._compactor = threading.Thread(target=self._compact, daemon=True)
+        self._compactor.start()
+        if wait:
+            self._compactor.join()
+
+    def _current_size(self) -> int:
+        """Размер журнала по последней сверке вместе с буфером"""
+        if self._size is None:
+            try:
+                self._size = os.path.getsize(self.path)
+            except OSError:
+                self._size = 0
+        return self._size + self._buffer_bytes
+
+    def _write_buffer(self, sync: bool) -> None:
+        """Дописывает буфер в конец файла, вызывается под блокировкой"""
+        if not self._buffer:
+            return
+        with file_lock(self.path):
+            self._write_locked(sync)
+
+    def _write_locked(self, sync: bool) -> None:
+        """Дописывает буфер, файловая блокировка уже взята"""
+        if not self._buffer:
+            return
+
+        # индекс должен покрывать весь файл до новой записи
+        self._refresh_index()
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        out = self._file
+        # конец файла берем у самого файла: его могли дописать другие оболочки
+        info = os.fstat(out.fileno())
+        self._file_id = file_id(info)
+
+        data = b"".join(self._buffer)
+        out.write(data)
+        out.flush()
+        if sync:
+            os.fsync(out.fileno())
+
+        ends = array("Q")
+        position = info.st_size
+        for item in self._buffer:
+            position += len(item)
+            ends.append(position)
+        self._append_index(ends)
+
+        self._size = position
+        self._buffer = []
+        self._buffer_bytes = 0
+
+    def _sync_index(self) -> None:
+        """Сверяет индекс с файлом под файловой блокировкой"""
+        with file_lock(self.path):
+            self._refresh_index()
+
+    def _refresh_index(self) -> None:
+        """Сверяет индекс с размером файла и досчитывает дописанные строки"""
+        try:
+            info = os.stat(self.path)
+            size, current = info.st_size, file_id(info)
+        except OSError:
+            size, current = 0, None
+        if current != self._file_id:
+            # файл сжали в другой оболочке - дескрипторы смотрят на старый
+            self._close_files()
+            self._file_id = current
+        self._size = size
+
+        # индекс дописывают и другие оболочки, его конец читаем каждый раз
+        self._load_index()
+        indexed = self._indexed or 0
+        if size < indexed or not self._ends_with_newline(indexed):
+            # файл подменили или обрезали - строим индекс заново
+            self._reset_index()
+        if size == self._indexed:
+            return
+
+        ends = array("Q")
+        position = self._indexed or 0
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            while True:
+                chunk = f.read(SCAN_CHUNK)
+                if not chunk:
+                    break
+                start = 0
+                while True:
+                    pos = chunk.find(b"\n", start)
+                    if pos == -1:
+                        break
+                    ends.append(position + pos + 1)
+                    start = pos + 1
+                position += len(chunk)
+
+        # недописанную последнюю строку завершаем переводом строки
+        if not ends or ends[-1] != position:
+            with open(self.path, "ab") as f:
+                f.write(b"\n")
+            position += 1
+            ends.append(position)
+            self._size = position
+
+        self._append_index(ends)
+
+    def _load_index(self) -> None:
+        """Читает из индекса только число записей и конец последней"""
+        self._count = 0
+        self._indexed = 0
+        try:
+            index_size = os.path.getsize(self.index_path)
+        except OSError:
+            return
+
+        self._count = index_size // 8
+        if self._count:
+            with open(self.index_path, "rb") as f:
+                f.seek((self._count - 1) * 8)
+                last = array("Q")
+                last.frombytes(f.read(8))
+                self._indexed = last[0]
+
+    def _reset_index(self) -> None:
+        """Сбрасывает индекс"""
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        with open(self.index_path, "wb"):
+            pass
+        self._count = 0
+        self._indexed = 0
+
+    def _append_index(self, ends: array) -> None:
+        """Дописывает концы строк в индекс"""
+        if not ends:
+            return
+        if self._index_file is None:
+            self._index_file = open(self.index_path, "ab")
+            # обрезаем неполную запись, оставшуюся после сбоя
+            if self._index_file.tell() != self._count * 8:
+                self._index_file.truncate(self._count * 8)
+                self._index_file.seek(self._count * 8)
+        index_file = self._index_file
+
+        index_file.write(ends.tobytes())
+        index_file.flush()
+        self._count += len(ends)
+        self._indexed = ends[-1]
+
+    def _ends_with_newline(self, position: int | None) -> bool:
+        """Проверяет, что проиндексированная часть заканчивается на границе строки"""
+        if not position:
+            return True
+        return self._read_range(position - 1, position) == b"\n"
+
+    def _read_entries(self, start: int, end: int) -> list[str]:
+        """Читает записи с номерами [start, end) одним куском"""
+        if start >= end:
+            return []
+
+        offsets = array("Q")
+        first = max(start - 1, 0)
+        with open(self.index_path, "rb") as f:
+            f.seek(first * 8)
+            offsets.frombytes(f.read((end - first) * 8))
+        if start == 0:
+            offsets.insert(0, 0)
+
+        data = self._read_range(offsets[0], offsets[-1])
+        return data.decode("utf-8", "replace").split("\n")[: end - start]
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        """Читает байты журнала через отображение в память"""
+        if self._map is None or len(self._map) < end:
+            self._open_map()
+
+        if self._map is not None:
+            return self._map[start:end]
+
+        # _open_map без отображения оставляет открытым файл для чтения
+        assert self._reader is not None
+        self._reader.seek(start)
+        return self._reader.read(end - start)
+
+    def _open_map(self) -> None:
+        """Отображает файл журнала в память, при неудаче читает его напрямую"""
+        self._close_map()
+        self._reader = reader = open(self.path, "rb")
+        try:
+            self._map = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self._map) != os.fstat(reader.fileno()).st_size:
+                self._close_map(keep_reader=True)
+        except (OSError, ValueError):
+            self._map = None
+
+    def _close_map(self, keep_reader: bool = False) -> None:
+        """Закрывает отображение файла"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._reader is not None and not keep_reader:
+            self._reader.close()
+            self._reader = None
+
+    def _close_files(self) -> None:
+        """Закрывает все открытые файлы журнала"""
+        self._close_map()
+        for attr in ("_file", "_index_file"):
+            f = getattr(self, attr)
+            if f is not None:
+                f.close()
+                setattr(self, attr, None)
+
+    def _compact(self) -> None:
+        """Переписывает журнал в фоне, не блокируя добавление команд"""
+        try:
+            self.flush(sync=False)
+            with open(self.path, "rb") as f:
+                snapshot_id = file_id(os.fstat(f.fileno()))
+                data = f.read()
+            snapshot_size = len(data)
+
+            # оставляем хвост из целых строк
+            keep = self.max_bytes // 2
+            if len(data) > keep:
+                cut = data.find(b"\n", len(data) - keep - 1)
+                data = data[cut + 1 :] if cut != -1 else b""
+
+            # у каждой оболочки свой временный файл
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+
+                # под блокировкой дописываем то, что пришло во время сжатия
+                with self._lock, file_lock(self.path):
+                    self._write_locked(sync=False)
+                    with open(self.path, "rb") as src:
+                        if file_id(os.fstat(src.fileno())) != snapshot_id:
+                            # журнал уже сжала другая оболочка
+                            os.remove(tmp_path)
+                            return
+                        src.seek(snapshot_size)
+                        tail = src.read()
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                    data += tail
+                    ends = array("Q")
+                    start = 0
+                    while (pos := data.find(b"\n", start)) != -1:
+                        ends.append(pos + 1)
+                        start = pos + 1
+
+                    # индекс удаляем до подмены файла, чтобы после сбоя он пересобрался
+                    self._close_files()
+                    if os.path.exists(self.index_path):
+                        os.remove(self.index_path)
+                    os.replace(tmp_path, self.path)
+                    with open(self.index_path, "wb") as index:
+                        index.write(ends.tobytes())
+                    self._file_id = file_id(os.stat(self.path))
+
+                    self._size = len(data)
+                    self._count = len(ends)
+                    self._indexed = ends[-1] if ends else 0
+        except OSError:
+            pass
+
+
+class UndoJournal:
+    """Журнал операций для отмены и повтора, переживает перезапуск оболочки
+
+    Каждое изменение дописывается строкой JSON: push - новая операция,
+    pop - отмена, redo - повтор, drop - вытеснение старой операции, clear -
+    сброс стека повтора. Стеки восстанавливаются при первом обращении и
+    перечитываются перед каждой новой операцией, чтобы оболочки не выдали
+    один номер дважды, а файл периодически переписывается только живыми
+    записями.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100) -> None:
+        """Файл журнала и сколько операций хранить"""
+        if max_entries <= 0:
+            raise Exception("Undo journal size must be positive")
+
+        self.path = path
+        self.max_entries = max_entries
+        self._stack: list[dict] | None = None
+        self._redo: list[dict] = []
+        self._next_id = 1
+        self._lines = 0
+
+    @property
+    def stack(self) -> list[dict]:
+        """Операции, которые можно отменить, последняя - в конце"""
+        if self._stack is None:
+            return self._load()
+        return self._stack
+
+    @property
+    def redo_stack(self) -> list[dict]:
+        """Отмененные операции, которые можно повторить, последняя - в конце"""
+        if self._stack is None:
+            self._load()
+        return self._redo
+
+    def push(self, operation: dict) -> list[dict]:
+        """Записывает новую операцию, возвращает вытесненные старые"""
+        # другая оболочка могла дописать свои операции: номер выдается по
+        # перечитанному журналу и под той же блокировкой, что и дозапись
+        with file_lock(self.path):
+            stack = self._load()
+            operation = {**operation, "id": self._next_id}
+            self._next_id += 1
+
+            records: list[dict] = []
+            if self._redo:
+                # после новой операции повторять отмененные уже нельзя
+                self._redo.clear()
+                records.append({"op": "clear"})
+            records.append({"op": "push", "entry": operation})
+            stack.append(operation)
+
+            dropped = []
+            while len(stack) > self.max_entries:
+                old = stack.pop(0)
+                records.append({"op": "drop", "id": old["id"]})
+                dropped.append(old)
+
+            self._append(records)
+        return dropped
+
+    def undo(self, count: int = 1) -> list[dict]:
+        """Переносит последние операции в стек повтора, последняя - первой"""
+        stack = self.stack
+        operations: list[dict] = []
+        while stack and len(operations) < count:
+            operation = stack.pop()
+            self._redo.append(operation)
+            operations.append(operation)
+
+        # вся пачка записывается одной дозаписью
+        if operations:
+            self._append([{"op": "pop", "id": op["id"]} for op in operations])
+        return operations
+
+    def redo(self, operations: list[dict]) -> None:
+        """Возвращает операции из стека повтора, первая уходит глубже"""
+        stack = self.stack
+        for operation in operations:
+            self._redo = [op for op in self._redo if op["id"] != operation["id"]]
+            stack.append(operation)
+
+        if operations:
+            self._append([{"op": "redo", "entry": op} for op in operations])
+
+    def _load(self) -> list[dict]:
+        """Восстанавливает стеки по журналу, возвращает стек отмены"""
+        live: dict[int, dict] = {}
+        redo: dict[int, dict] = {}
+        lines = 0
+        valid_end = 0
+        try:
+            with open(self.path, "rb") as f:
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        # строка оборвалась при сбое
+                        break
+                    try:
+                        record = json.loads(raw)
+                    except ValueError:
+                        break
+                    valid_end += len(raw)
+                    lines += 1
+
+                    op = record.get("op")
+                    if op == "push":
+                        entry = record["entry"]
+                        live[entry["id"]] = entry
+                        self._next_id = max(self._next_id, entry["id"] + 1)
+                    elif op == "pop":
+                        entry = live.pop(record["id"], None)
+                        if entry is not None:
+                            redo[entry["id"]] = entry
+                    elif op == "redo":
+                        entry = record["entry"]
+                        redo.pop(entry["id"], None)
+                        live[entry["id"]] = entry
+                    elif op == "drop":
+                        live.pop(record["id"], None)
+                    elif op == "clear":
+                        redo.clear()
+
+            if valid_end != os.path.getsize(self.path):
+                # отбрасываем недописанный хвост, чтобы дозапись не склеилась с ним
+                with open(self.path, "r+b") as f:
+                    f.truncate(valid_end)
+        except OSError:
+            pass
+
+        self._stack = stack = list(live.values())
+        self._redo = list(redo.values())
+        self._lines = lines
+        return stack
+
+    def _append(self, records: list[dict]) -> None:
+        """Дописывает записи и сразу сбрасывает их на диск"""
+        # вытеснение держит стеки в пределах лимита, а файл - в пределах
+        # нескольких лимитов, так что восстановление читает немного строк
+        if self._lines + len(records) > self.max_entries * 3:
+            self._compact()
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        with open(self.path, "ab") as f:
+            f.write(data.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines += len(records)
+
+    def _compact(self) -> None:
+        """Переписывает журнал только живыми операциями"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        records: list[dict] = [{"op": "push", "entry": op} for op in self.stack]
+        for operation in self._redo:
+            records.append({"op": "push", "entry": operation})
+            records.append({"op": "pop", "id": operation["id"]})
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for record in records:
+                f.write((json.dumps(record) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(records)
@@ -0,0 +1,191 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# журнал команд по умолчанию
+LOG_FILE = os.path.join(os.path.dirname(__file__), "shell.log")
+
+LOG_POLICIES = ("drop", "block")
+
+LOG_FORMATS = ("text", "json")
+
+# формат журнала можно выбрать переменной окружения
+LOG_FORMAT_ENV = "SHELL_LOG_FORMAT"
+
+# сколько записей может ждать фоновой записи
+LOG_QUEUE_SIZE = 10000
+
+# ротация журнала: размер файла, возраст файла в секундах, число старых копий
+LOG_MAX_BYTES = 1024 * 1024
+LOG_MAX_AGE = 24 * 3600
+LOG_BACKUP_COUNT = 3
+
+LOG_FORMAT = "[%(asctime)s] %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+
+# фоновый писатель журнала, один на процесс
+_listener: QueueListener | None = None
+
+
+class RotatingLogHandler(RotatingFileHandler):
+    """Файл журнала с ротацией по размеру и по возрасту"""
+
+    def __init__(
+        self, filename: str, max_bytes: int, max_age: float, backup_count: int
+    ) -> None:
+        """Файл журнала открывается при первой записи"""
+        super().__init__(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        self.max_age = max_age
+        self.rollover_at: float | None = None
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        """Пора ли начинать новый файл"""
+        now = time.time()
+        if self.rollover_at is None:
+            # после перезапуска возраст файла считаем по последней записи в него
+            try:
+                started = os.path.getmtime(self.baseFilename)
+            except OSError:
+                started = now
+            self.rollover_at = started + self.max_age
+
+        if self.max_age > 0 and now >= self.rollover_at:
+            return os.path.exists(self.baseFilename)
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        """Сдвигает старые копии и открывает новый файл"""
+        super().doRollover()
+        self.rollover_at = time.time() + self.max_age
+
+
+class JsonFormatter(logging.Formatter):
+    """Записи журнала в виде строк JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Поля команды, если запись о ней, иначе текст сообщения"""
+        data: dict[str, object] = {
+            "time": datetime.fromtimestamp(record.created)
+            .astimezone()
+            .isoformat(timespec="milliseconds")
+        }
+        if hasattr(record, "status"):
+            data.update(
+                command=getattr(record, "command", None),
+                args=getattr(record, "args_list", None),
+                cwd=getattr(record, "cwd", None),
+                duration=round(getattr(record, "duration", 0.0), 6),
+                status=getattr(record, "status", None),
+                error=getattr(record, "error", None),
+            )
+        else:
+            data.update(level=record.levelname, message=record.getMessage())
+        return json.dumps(data, ensure_ascii=False)
+
+
+def is_not_start(record: logging.LogRecord) -> bool:
+    """В JSON пишем только итог команды, запись о начале не нужна"""
+    return getattr(record, "event", None) != "start"
+
+
+class LogQueueHandler(QueueHandler):
+    """Передает записи фоновому писателю, не дожидаясь записи в файл"""
+
+    def __init__(self, log_queue: queue.Queue[logging.LogRecord], policy: str) -> None:
+        """Очередь и поведение при ее переполнении"""
+        if policy not in LOG_POLICIES:
+            raise Exception(f"Unknown log policy: {policy}")
+        super().__init__(log_queue)
+        # self.queue у QueueHandler типизирован слишком общо, храним свою ссылку
+        self.log_queue = log_queue
+        self.policy = policy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Форматирование откладываем до фонового потока"""
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Кладет запись в очередь: при переполнении ждет или отбрасывает"""
+        if self.policy == "block":
+            self.log_queue.put(record)
+            return
+        try:
+            self.log_queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    path: str = LOG_FILE,
+    policy: str = "drop",
+    queue_size: int = LOG_QUEUE_SIZE,
+    max_bytes: int = LOG_MAX_BYTES,
+    max_age: float = LOG_MAX_AGE,
+    backup_count: int = LOG_BACKUP_COUNT,
+    log_format: str | None = None,
+) -> None:
+    """Направляет корневой логгер в файл через фоновый поток"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if log_format is None:
+        log_format = os.environ.get(LOG_FORMAT_ENV, "text")
+    if log_format not in LOG_FORMATS:
+        raise Exception(f"Unknown log format: {log_format}")
+
+    file_handler = RotatingLogHandler(path, max_bytes, max_age, backup_count)
+    if log_format == "json":
+        file_handler.setFormatter(JsonFormatter())
+        file_handler.addFilter(is_not_start)
+    else:
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(queue_size)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(LogQueueHandler(log_queue, policy))
+
+    _listener = QueueListener(log_queue, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает очередь в файл и останавливает фоновый поток"""
+    global _listener
+    if _listener is None:
+        return
+
+    listener = _listener
+    _listener = None
+    root = logging.getLogger()
+    dropped = 0
+    for handler in list(root.handlers):
+        if isinstance(handler, LogQueueHandler):
+            root.removeHandler(handler)
+            dropped += handler.dropped
+
+    listener.stop()
+    for file_handler in listener.handlers:
+        if dropped:
+            # сообщаем о потерях в сам журнал
+            message = f"WARNING: {dropped} log records dropped"
+            file_handler.handle(
+                logging.makeLogRecord(
+                    {"msg": message, "levelno": logging.WARNING, "levelname": "WARNING"}
+                )
+            )
+        file_handler.close()
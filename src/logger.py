@@ -1,19 +1,74 @@
+import logging
+import os
+import time
+
+from src.output import output
+from src.stats import io_counters, stats
+
+
+def error_message(error: Exception) -> str:
+    """Текст ошибки без префикса [Errno N]"""
+    if isinstance(error, OSError) and error.strerror:
+        if error.filename2 is not None:
+            return f"{error.strerror}: {error.filename!r} -> {error.filename2!r}"
+        if error.filename is not None:
+            return f"{error.strerror}: {error.filename!r}"
+        return error.strerror
+    return str(error)
+
+
 def log(func):
-    def wrapper(self, args: list[str]) -> None:
-        # логгируем команду
-        command = f"{func.__name__} {' '.join(args)}"
-        self.logger.info(command)
+    def wrapper(self, args: list[str], **kwargs) -> None:
+        logger = self.logger
+        name = func.__name__
+        cwd = None
+        # логгируем команду, текст собирается только в обработчике журнала
+        if logger.isEnabledFor(logging.INFO):
+            cwd = os.getcwd()
+            logger.info("%s %s", name, " ".join(args), extra={"event": "start"})
+
+        # счетчики ввода-вывода читаем вне замера времени: чтение /proc
+        # не должно попадать в длительность команды
+        read_started, write_started = io_counters()
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        error = None
 
         try:
             # вызываем оригинальную функцию
-            result = func(self, args)
-            self.logger.info("SUCCESS")
-            return result
+            return func(self, args, **kwargs)
         except Exception as e:
-            error_msg = str(e)
-            if error_msg.startswith("["):
-                error_msg = error_msg.split("] ", 1)[1]
-            self.logger.error(f"ERROR: {error_msg}")
+            error = error_message(e)
             raise
+        finally:
+            # выводим накопленное командой до возврата к приглашению
+            output.flush()
+
+            duration = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+            read_now, write_now = io_counters()
+            stats.record(
+                name,
+                duration,
+                cpu,
+                read_now - read_started,
+                write_now - write_started,
+                error is not None,
+            )
+
+            level = logging.INFO if error is None else logging.ERROR
+            if logger.isEnabledFor(level):
+                fields = {
+                    "command": name,
+                    "args_list": args,
+                    "cwd": cwd if cwd is not None else os.getcwd(),
+                    "duration": duration,
+                    "status": "ok" if error is None else "error",
+                    "error": error,
+                }
+                if error is None:
+                    logger.info("SUCCESS", extra=fields)
+                else:
+                    logger.error("ERROR: %s", error, extra=fields)
 
     return wrapper
@@ -1,8 +1,15 @@
 import os
+import sys
+from collections.abc import Iterable, Iterator
 
+from src.logger import error_message
+from src.output import output
 from src.plugins.history import HistoryPlugin
+from src.registry import ARCHIVE, HISTORY, SEARCH, TERMINAL, CommandRegistry
 from src.terminal import Terminal
 
+USAGE = "Usage: python -m src.main [-c COMMANDS | SCRIPT] [--no-history]"
+
 
 def quotes(inp: str) -> list[str]:
     """Добавляет к именам с пробелами кавычки"""
@@ -29,78 +36,211 @@ def quotes(inp: str) -> list[str]:
     return res
 
 
-def main() -> None:
-    """Запуск эмулятора терминала"""
-    terminal = Terminal()
-    history_plugin = HistoryPlugin(terminal.logger)
+def split_commands(text: str) -> Iterator[str]:
+    """Разбивает текст на команды по ; и переводам строк вне кавычек"""
+    curr = ""
+    single = False
+    double = False
 
-    while True:
+    for char in text:
+        if char == "'" and not double:
+            single = not single
+        elif char == '"' and not single:
+            double = not double
+        elif char in ";\n" and not single and not double:
+            yield curr
+            curr = ""
+            continue
+        curr += char
+
+    yield curr
+
+
+def script_lines(path: str) -> Iterator[str]:
+    """Читает команды из файла сценария построчно, - означает stdin"""
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, encoding="utf-8") as f:
+        yield from f
+
+
+def execute(
+    registry: CommandRegistry,
+    history_plugin: HistoryPlugin,
+    command_name: str,
+    args: list[str],
+) -> bool:
+    """Выполняет одну команду, возвращает False для exit"""
+    if command_name == "exit":
+        return False
+
+    spec = registry.get(command_name)
+    if spec is None:
+        unknown_cmd = f"{command_name} {' '.join(args)}"
+        registry.logger.error("ERROR: Unknown command: %s", unknown_cmd)
+        raise Exception(f"Unknown command: {unknown_cmd}")
+
+    handler = registry.handler(spec)
+    if spec.needs_backup:
+        backup_info = history_plugin.create_backup(args)
         try:
+            handler(args, backup_info=backup_info)
+        finally:
+            # даже при частичной ошибке запоминаем перенесенное
+            history_plugin.record_for_undo(command_name, args, backup_info)
+    else:
+        handler(args)
+        if spec.undoable:
+            history_plugin.record_for_undo(command_name, args)
+    return True
+
+
+class Shell:
+    """Цикл выполнения команд: с приглашением или из сценария"""
+
+    def __init__(self, save_history: bool = True) -> None:
+        """Терминал, история и нужно ли записывать команды в историю"""
+        self.terminal = Terminal()
+        self.history_plugin = HistoryPlugin(self.terminal.logger)
+        # остальные исполнители команд создаются при первом обращении,
+        # плагины терминала - им самим, чтобы ls и tar делили один экземпляр
+        self.registry = CommandRegistry(
+            self.terminal.logger,
+            {TERMINAL: self.terminal, HISTORY: self.history_plugin},
+            {
+                ARCHIVE: lambda: self.terminal.archive_plugin,
+                SEARCH: lambda: self.terminal.search_plugin,
+            },
+        )
+        self.save_history = save_history
+        self.failed = 0
+        # журнал включается перед первой командой, а не при запуске
+        self.logging_started = False
+
+    def run_line(self, inp: str) -> bool:
+        """Разбирает и выполняет строку, возвращает False для exit"""
+        inp = inp.strip()
+        if not inp or inp.startswith("#"):
+            return True
+
+        command = quotes(inp)
+        if not command:
+            return True
+
+        command_name, args = command[0], command[1:]
+        self.start_logging()
+
+        # добавляем команду в историю
+        if self.save_history:
+            self.history_plugin.add_command(command_name, args)
+
+        try:
+            return execute(self.registry, self.history_plugin, command_name, args)
+        except Exception as e:
+            self.failed += 1
+            print(f"ERROR: {error_message(e)}")
+            return True
+
+    def run_script(self, lines: Iterable[str]) -> None:
+        """Выполняет команды подряд, без приглашения"""
+        for line in lines:
+            for inp in split_commands(line):
+                if not self.run_line(inp):
+                    return
+
+    def run_interactive(self) -> None:
+        """Читает команды с приглашением"""
+        home_dir = os.path.expanduser("~")
+        while True:
             curr_dir = os.getcwd()
-            home_dir = os.path.expanduser("~")
             if curr_dir.startswith(home_dir):
                 curr_dir = "~" + curr_dir[len(home_dir) :]
 
-            inp = input(f"{curr_dir} $ ").strip()
-
-            if not inp:
-                continue
-
-            command = quotes(inp)
-
-            if not command:
-                continue
-
-            command_name, args = command[0], command[1:]
-
-            # добавляем команду в историю
-            history_plugin.add_command(command_name, args)
-
-            # выполняем команду
-            match command_name:
-                case "ls":
-                    terminal.ls(args)
-                case "cd":
-                    terminal.cd(args)
-                case "cat":
-                    terminal.cat(args)
-                case "cp":
-                    terminal.cp(args)
-                    history_plugin.record_for_undo(command_name, args)
-                case "mv":
-                    terminal.mv(args)
-                    history_plugin.record_for_undo(command_name, args)
-                case "rm":
-                    backup_info = history_plugin.create_backup(args)
-                    terminal.rm(args)
-                    history_plugin.record_for_undo(command_name, args, backup_info)
-                case "zip":
-                    terminal.archive_plugin.zip(args)
-                case "unzip":
-                    terminal.archive_plugin.unzip(args)
-                case "tar":
-                    terminal.archive_plugin.tar(args)
-                case "untar":
-                    terminal.archive_plugin.untar(args)
-                case "grep":
-                    terminal.search_plugin.grep(args)
-                case "history":
-                    history_plugin.show_history(args)
-                case "undo":
-                    history_plugin.undo(args)
-                case "exit":
-                    break
-                case _:
-                    unknown_cmd = f"{command_name} {' '.join(args)}"
-                    terminal.logger.error(f"ERROR: Unknown command: {unknown_cmd}")
-                    print(f"ERROR: Unknown command: {unknown_cmd}")
+            output.flush()
+            try:
+                inp = input(f"{curr_dir} $ ")
+            except EOFError:
+                return
+            if not self.run_line(inp):
+                return
+
+    def start_logging(self) -> None:
+        """Запускает фоновую запись журнала"""
+        if self.logging_started:
+            return
+        from src.logconfig import setup_logging
+
+        setup_logging()
+        self.logging_started = True
+
+    def close(self) -> None:
+        """Сохраняет историю и журнал при выходе"""
+        output.flush()
+        # сохраняем историю, накопленную в буфере
+        self.history_plugin.close()
+        # дописываем журнал, ожидающий в очереди
+        if self.logging_started:
+            from src.logconfig import stop_logging
+
+            stop_logging()
+
+
+def parse_argv(argv: list[str]) -> tuple[str | None, str | None, bool]:
+    """Разбирает аргументы запуска: [-c COMMANDS | SCRIPT] [--no-history]"""
+    commands = None
+    script = None
+    save_history = True
+
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-c":
+            if i + 1 >= len(argv):
+                raise Exception("Option -c requires an argument")
+            commands = argv[i + 1]
+            i += 1
+        elif arg == "--no-history":
+            save_history = False
+        elif arg.startswith("-") and arg != "-":
+            raise Exception(f"Unknown option: {arg}")
+        elif script is None:
+            script = arg
+        else:
+            raise Exception("Too many arguments")
+        i += 1
 
-        except Exception as e:
-            error_msg = str(e)
-            if error_msg.startswith("["):
-                error_msg = error_msg.split("] ", 1)[1]
-            print(f"ERROR: {error_msg}")
+    if commands is not None and script is not None:
+        raise Exception("Cannot combine -c with a script file")
+    return commands, script, save_history
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Запуск эмулятора терминала"""
+    try:
+        commands, script, save_history = parse_argv(
+            sys.argv[1:] if argv is None else argv
+        )
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        print(USAGE, file=sys.stderr)
+        return 2
+
+    shell = Shell(save_history=save_history)
+    interactive = commands is None and script is None
+    try:
+        if commands is not None:
+            shell.run_script([commands])
+        elif script is not None:
+            shell.run_script(script_lines(script))
+        else:
+            shell.run_interactive()
+    finally:
+        shell.close()
+
+    # в сценариях код возврата сообщает, были ли ошибки
+    return 1 if shell.failed and not interactive else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import io
+import os
+import stat
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TextIO
+
+# сколько текста копим перед записью в stdout
+BUFFER_SIZE = 64 * 1024
+
+
+def format_size(size: float) -> str:
+    """Размер в читаемом виде"""
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024
+        if size < 1024:
+            break
+    return f"{size:.1f} {unit}"
+
+
+def progress_line(verb: str, files: int, size: int) -> None:
+    """Строка прогресса копирования или распаковки в stderr"""
+    sys.stderr.write(f"\r{verb} {files} files, {format_size(size)}")
+    sys.stderr.flush()
+
+
+def progress_summary(verb: str, files: int, size: int, elapsed: float) -> str:
+    """Завершает строку прогресса, возвращает итог со скоростью"""
+    sys.stderr.write("\n")
+    rate = format_size(size / max(elapsed, 1e-6))
+    return f"{verb} {files} files, {format_size(size)} in {elapsed:.2f}s ({rate}/s)"
+
+
+class Output:
+    """Буферизованный вывод команд в stdout"""
+
+    def __init__(self, stream: TextIO | None = None, buffer_size: int = BUFFER_SIZE):
+        """Поток вывода, по умолчанию - текущий sys.stdout"""
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.closed = False
+        self._parts: list[str] = []
+        self._size = 0
+
+    def write(self, text: str) -> None:
+        """Добавляет текст в буфер"""
+        if self.closed or not text:
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def line(self, text: str = "") -> None:
+        """Добавляет строку в буфер"""
+        self.write(text + "\n")
+
+    def flush(self) -> None:
+        """Записывает буфер в поток одним вызовом"""
+        if not self._parts:
+            return
+
+        data = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        if self.closed:
+            return
+
+        stream = self.stream or sys.stdout
+        try:
+            stream.write(data)
+            stream.flush()
+        except BrokenPipeError:
+            self.broken_pipe()
+
+    def sendfile(self, in_fd: int, offset: int, count: int) -> bool:
+        """Копирует часть файла в stdout средствами ядра
+
+        Работает, только если stdout - обычный файл или канал. Возвращает
+        False, если нужно выводить данные обычным способом.
+        """
+        if self.closed or self.stream is not None:
+            return self.closed
+
+        try:
+            out_fd = sys.stdout.fileno()
+            mode = os.fstat(out_fd).st_mode
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return False
+        if not (stat.S_ISREG(mode) or stat.S_ISFIFO(mode)):
+            return False
+
+        self.flush()
+        sys.stdout.flush()
+        sent_total = 0
+        try:
+            while count > 0:
+                sent = os.sendfile(out_fd, in_fd, offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+                sent_total += sent
+        except BrokenPipeError:
+            self.broken_pipe()
+        except OSError:
+            # ядро не поддерживает такую пару дескрипторов
+            if sent_total == 0:
+                return False
+            raise
+        return True
+
+    def broken_pipe(self) -> None:
+        """Читатель закрыл канал: дальше вывод просто отбрасываем"""
+        self.closed = True
+        self._parts = []
+        self._size = 0
+        if self.stream is not None:
+            return
+
+        # перенаправляем stdout в /dev/null, чтобы не упасть при выходе
+        try:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+        except (OSError, ValueError, io.UnsupportedOperation):
+            pass
+
+    @contextmanager
+    def capture(self) -> Iterator[io.StringIO]:
+        """Временно перенаправляет вывод в строку, удобно для тестов"""
+        self.flush()
+        old_stream = self.stream
+        buffer = io.StringIO()
+        self.stream = buffer
+        try:
+            yield buffer
+        finally:
+            self.flush()
+            self.stream = old_stream
+
+
+output = Output()
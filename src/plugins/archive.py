@@ -1,8 +1,67 @@
+import io
+import json
 import logging
 import os
-import shutil
+import tarfile
+import time
+from functools import partial
+from typing import IO, cast
 
+from src.archiveindex import (
+    INDEX_SUFFIX,
+    IndexedTarFile,
+    TarIndex,
+    zip_extract,
+    zip_members,
+)
+from src.extractor import Extractor, safe_path
+from src.gzipwriter import ParallelGzipWriter
 from src.logger import log
+from src.output import progress_line, progress_summary
+from src.snapshot import SNAPSHOT_MEMBER, Manifest
+from src.trash import remove_path
+from src.zipwriter import ZipWriter
+
+
+def parse_level(args: list[str]) -> tuple[int, list[str]]:
+    """Отделяет степень сжатия -0..-9 от остальных аргументов"""
+    level = 6
+    rest = []
+    for arg in args:
+        if len(arg) == 2 and arg[0] == "-" and arg[1].isdigit():
+            level = int(arg[1])
+        else:
+            rest.append(arg)
+    return level, rest
+
+
+def take_option(args: list[str], name: str) -> tuple[str | None, list[str]]:
+    """Отделяет опцию name вместе с ее значением от остальных аргументов"""
+    if name not in args:
+        return None, args
+    index = args.index(name)
+    if index + 1 >= len(args):
+        raise Exception(f"Option {name} requires a value")
+    return args[index + 1], args[:index] + args[index + 2 :]
+
+
+def print_summary(extractor: Extractor, elapsed: float) -> None:
+    """Итог распаковки с -v"""
+    print(progress_summary("Extracted", extractor.files, extractor.bytes, elapsed))
+
+
+def save_index(archive: str, tar: IndexedTarFile, gz: ParallelGzipWriter) -> None:
+    """Сохраняет рядом с архивом индекс для чтения отдельных членов"""
+    index = TarIndex(archive)
+    index.blocks = gz.blocks
+    index.members = tar.index_members
+    index.save()
+
+
+def remove_partial(path: str) -> None:
+    """Удаляет недописанный архив"""
+    if os.path.exists(path):
+        os.remove(path)
 
 
 class ArchivePlugin:
@@ -14,58 +73,228 @@ class ArchivePlugin:
 
     @log
     def zip(self, args: list[str]) -> None:
-        """Создание zip архива"""
-        if len(args) != 2:
-            raise Exception("Usage: zip <folder> <archive>")
+        """Создание zip архива: zip <folder> <archive> [-0..-9]"""
+        level, paths = parse_level(args)
+        if len(paths) != 2:
+            raise Exception("Usage: zip <folder> <archive> [-0..-9]")
 
-        folder, archive = args[0], args[1]
+        folder, archive = paths
         if not archive.endswith(".zip"):
             archive += ".zip"
+        if not os.path.isdir(folder):
+            raise Exception(f"Not a directory: {folder}")
 
-        shutil.make_archive(archive.replace(".zip", ""), "zip", folder)
+        # файлы сжимаются параллельно и сразу пишутся в архив по порядку
+        writer = ZipWriter(archive, level)
+        try:
+            writer.write_tree(folder)
+        except BaseException:
+            # недописанный архив не оставляем
+            remove_partial(archive)
+            raise
         print(f"Created: {archive}")
 
     @log
     def unzip(self, args: list[str]) -> None:
-        """Распаковка zip архива"""
-        if len(args) != 1:
-            raise Exception("Usage: unzip <archive>")
+        """Распаковка zip архива: unzip <archive> [-v]"""
+        verbose = "-v" in args
+        paths = [arg for arg in args if arg != "-v"]
+        if len(paths) != 1:
+            raise Exception("Usage: unzip <archive> [-v]")
 
-        archive = args[0]
+        archive = paths[0]
         if not archive.endswith(".zip"):
             archive += ".zip"
 
         extract_dir = archive.replace(".zip", "")
         os.makedirs(extract_dir, exist_ok=True)
 
-        shutil.unpack_archive(archive, extract_dir)
+        # файлы распаковываются параллельно, каждый поток читает архив сам
+        extractor = Extractor(
+            progress=partial(progress_line, "Extracted") if verbose else None
+        )
+        elapsed = extractor.extract_zip(archive, extract_dir)
+        if verbose:
+            print_summary(extractor, elapsed)
         print(f"Extracted: {archive} to {extract_dir}/")
 
     @log
     def tar(self, args: list[str]) -> None:
-        """Создание tar.gz архива"""
-        if len(args) != 2:
-            raise Exception("Usage: tar <folder> <archive>")
+        """Создание tar.gz архива: tar <folder> <archive> [-0..-9] [-g <manifest>]"""
+        level, args = parse_level(args)
+        manifest_path, paths = take_option(args, "-g")
+        use_hash = "--hash" in paths
+        paths = [arg for arg in paths if arg != "--hash"]
+        if len(paths) != 2 or (use_hash and manifest_path is None):
+            raise Exception(
+                "Usage: tar <folder> <archive> [-0..-9] [-g <manifest> [--hash]]"
+            )
 
-        folder, archive = args[0], args[1]
+        folder, archive = paths
         if not archive.endswith(".tar.gz"):
             archive += ".tar.gz"
+        if not os.path.isdir(folder):
+            raise Exception(f"Not a directory: {folder}")
+
+        if manifest_path is not None:
+            self.tar_snapshot(folder, archive, level, manifest_path, use_hash)
+            return
+
+        # архив внутри упаковываемой директории не упаковываем
+        own_name = "./" + os.path.relpath(archive, folder).replace(os.sep, "/")
+
+        def skip_archive(info: tarfile.TarInfo) -> tarfile.TarInfo | None:
+            """Фильтр, исключающий сам архив и его индекс"""
+            return None if info.name in (own_name, own_name + INDEX_SUFFIX) else info
 
-        shutil.make_archive(archive.replace(".tar.gz", ""), "gztar", folder)
+        # tar пишется потоком, блоки по 1 МиБ сжимаются параллельно
+        try:
+            with ParallelGzipWriter(archive, level) as gz:
+                # потоковому режиму хватает write, IO[bytes] нужен только для типов
+                with IndexedTarFile.open(fileobj=cast(IO[bytes], gz), mode="w|") as tar:
+                    tar.add(folder, arcname=".", filter=skip_archive)
+        except BaseException:
+            remove_partial(archive)
+            raise
+        save_index(archive, tar, gz)
         print(f"Created: {archive}")
 
     @log
     def untar(self, args: list[str]) -> None:
-        """Распаковка tar.gz архива"""
-        if len(args) != 1:
-            raise Exception("Usage: untar <archive>")
+        """Распаковка tar.gz архива: untar <archive> [-v] [-g <manifest>]"""
+        manifest_path, args = take_option(args, "-g")
+        verbose = "-v" in args
+        paths = [arg for arg in args if arg != "-v"]
+        if len(paths) != 1:
+            raise Exception("Usage: untar <archive> [-v] [-g <manifest>]")
 
-        archive = args[0]
+        archive = paths[0]
         if not archive.endswith(".tar.gz"):
             archive += ".tar.gz"
 
         extract_dir = archive.replace(".tar.gz", "")
         os.makedirs(extract_dir, exist_ok=True)
 
-        shutil.unpack_archive(archive, extract_dir)
+        # члены архива распаковываются по мере чтения потока
+        extractor = Extractor(
+            progress=partial(progress_line, "Extracted") if verbose else None
+        )
+        if manifest_path is not None:
+            elapsed = self.restore_chain(archive, extract_dir, manifest_path, extractor)
+        else:
+            # служебный член снимка пропускаем и без -g
+            elapsed = extractor.extract_tar(archive, extract_dir, SNAPSHOT_MEMBER)
+        if verbose:
+            print_summary(extractor, elapsed)
         print(f"Extracted: {archive} to {extract_dir}/")
+
+    @log
+    def extract(self, args: list[str]) -> None:
+        """Извлечение одного файла: extract <archive> <member> [<destination>]"""
+        if len(args) not in (2, 3):
+            raise Exception("Usage: extract <archive> <member> [<destination>]")
+
+        archive, name = args[0], args[1]
+        destination = args[2] if len(args) == 3 else os.path.basename(name)
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, os.path.basename(name))
+
+        # zip читает только центральный каталог и данные нужного файла,
+        # tar.gz - начиная с ближайшего к файлу блока gzip по индексу
+        if archive.endswith(".zip"):
+            zip_extract(archive, name, destination)
+        elif archive.endswith(".tar.gz"):
+            TarIndex.for_archive(archive).extract(name, destination)
+        else:
+            raise Exception(f"Unsupported archive: {archive}")
+        print(f"Extracted: {name} to {destination}")
+
+    def members(self, archive: str) -> list[tuple[str, os.stat_result]]:
+        """Содержимое архива для ls без распаковки"""
+        if archive.endswith(".zip"):
+            return zip_members(archive)
+        # просмотр ничего не пишет: устаревший индекс обновит extract
+        return TarIndex.for_archive(archive, save=False).list()
+
+    def tar_snapshot(
+        self, folder: str, archive: str, level: int, manifest_path: str, use_hash: bool
+    ) -> None:
+        """Инкрементный снимок: в архив идут только новые и измененные файлы"""
+        manifest = Manifest(manifest_path).load()
+        root = os.path.abspath(folder)
+        if manifest.root is not None and manifest.root != root:
+            raise Exception(f"Manifest {manifest_path} belongs to {manifest.root}")
+        archive_path = os.path.abspath(archive)
+        if archive_path in manifest.chain:
+            raise Exception(f"Archive is already in the snapshot chain: {archive}")
+
+        skip = {
+            os.path.realpath(archive),
+            os.path.realpath(archive + INDEX_SUFFIX),
+            os.path.realpath(manifest_path),
+        }
+        files, directories, changed, deleted = manifest.scan(folder, skip, use_hash)
+        # первый снимок полный, следующие ссылаются на предыдущий
+        info = {
+            "base": manifest.chain[-1] if manifest.chain else None,
+            "level": len(manifest.chain),
+            "deleted": deleted,
+        }
+        data = json.dumps(info).encode("utf-8")
+
+        try:
+            with ParallelGzipWriter(archive, level) as gz:
+                with IndexedTarFile.open(fileobj=cast(IO[bytes], gz), mode="w|") as tar:
+                    member = tarfile.TarInfo("./" + SNAPSHOT_MEMBER)
+                    member.size = len(data)
+                    member.mtime = int(time.time())
+                    tar.addfile(member, io.BytesIO(data))
+
+                    # директории пишем всегда: так сохраняются и пустые
+                    tar.add(folder, arcname=".", recursive=False)
+                    for rel in directories + changed:
+                        tar.add(
+                            os.path.join(folder, rel),
+                            arcname="./" + rel,
+                            recursive=False,
+                        )
+        except BaseException:
+            remove_partial(archive)
+            raise
+
+        save_index(archive, tar, gz)
+        # манифест обновляем только после того, как архив дописан
+        manifest.root = root
+        manifest.files = files
+        manifest.directories = directories
+        manifest.chain.append(archive_path)
+        manifest.save()
+        print(f"Created: {archive} ({len(changed)} changed, {len(deleted)} deleted)")
+
+    def restore_chain(
+        self, archive: str, extract_dir: str, manifest_path: str, extractor: Extractor
+    ) -> float:
+        """Восстанавливает снимок archive по цепочке из манифеста"""
+        manifest = Manifest(manifest_path).load()
+        archive_path = os.path.abspath(archive)
+        if archive_path not in manifest.chain:
+            raise Exception(f"Archive is not in the snapshot chain: {archive}")
+
+        def apply_deletions(info: dict) -> None:
+            """Удаляет пути, которых не стало к этому снимку"""
+            for rel in info.get("deleted", []):
+                name = os.path.basename(rel)
+                if name in ("", ".", ".."):
+                    raise Exception(f"Unsafe path in archive: {rel}")
+                # саму ссылку удаляем, не переходя по ней
+                parent = safe_path(extract_dir, os.path.dirname(rel))
+                remove_path(os.path.join(parent, name))
+
+        elapsed = 0.0
+        chain = manifest.chain[: manifest.chain.index(archive_path) + 1]
+        for snapshot in chain:
+            # список удалений идет первым членом архива, до новых файлов
+            elapsed += extractor.extract_tar(
+                snapshot, extract_dir, SNAPSHOT_MEMBER, apply_deletions
+            )
+        return elapsed
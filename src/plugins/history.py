@@ -1,8 +1,12 @@
 import logging
 import os
 import shutil
+from collections.abc import Callable, Iterable
 
+from src import trash
+from src.journal import HistoryJournal, UndoJournal
 from src.logger import log
+from src.trash import Trash
 
 
 class HistoryPlugin:
@@ -13,53 +17,46 @@ class HistoryPlugin:
         self.logger = logger
         self.history_file = os.path.join(os.path.dirname(__file__), ".history")
         self.trash_dir = os.path.join(os.path.dirname(__file__), ".trash")
-        self.history: list[dict] = []
-        self.undo_stack: list[dict] = []
-        self.load_history()
+        self.undo_file = os.path.join(os.path.dirname(__file__), ".undo")
 
-        # создаем директорию для корзины
-        os.makedirs(self.trash_dir, exist_ok=True)
+        # история читается лениво, при старте файл не открывается
+        self.journal = HistoryJournal(self.history_file)
 
-    def load_history(self) -> None:
-        """Загружает историю из файла"""
-        self.history = []
+        # директории корзины создаются при первом удалении
+        self.trash = Trash(self.trash_dir)
+
+        # операции для отмены переживают перезапуск, журнал читается лениво
+        self.undo_journal = UndoJournal(self.undo_file)
+
+    @property
+    def undo_stack(self) -> list[dict]:
+        """Операции, которые можно отменить"""
+        return self.undo_journal.stack
+
+    def save_history(self) -> None:
+        """Сбрасывает накопленные команды в файл истории"""
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if line:
-                            history_item = {
-                                "command": line,
-                                "args": [],
-                                "cwd": os.getcwd(),
-                            }
-                            self.history.append(history_item)
+            self.journal.flush()
         except Exception:
-            self.history = []
+            pass
 
-    def save_history(self) -> None:
-        """Сохраняет историю в файл"""
+    def close(self) -> None:
+        """Сохраняет историю при выходе"""
         try:
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                for item in self.history:
-                    command = item["command"]
-                    f.write(f"{command}\n")
+            self.journal.close()
         except Exception:
             pass
 
     def add_command(self, command: str, args: list[str]) -> None:
         """Добавляет команду в историю"""
-        history_item = {
-            "command": f"{command} {' '.join(args)}".strip(),
-            "args": args,
-            "cwd": os.getcwd(),
-        }
-        self.history.append(history_item)
-        self.save_history()
+        # дописываем команду в журнал вместо перезаписи всего файла
+        try:
+            self.journal.append(f"{command} {' '.join(args)}".strip())
+        except Exception:
+            pass
 
     def create_backup(self, args: list[str]) -> list[dict]:
-        """Создает резервные копии файлов"""
+        """Резервирует место в корзине: rm перенесет туда цели вместо удаления"""
         recursive = "-r" in args
         targets = [arg for arg in args if arg != "-r"]
 
@@ -67,28 +64,14 @@ class HistoryPlugin:
         for target in targets:
             target_path = os.path.abspath(target)
 
-            if os.path.exists(target_path):
-                trash_name = os.path.basename(target_path)
-                trash_path = os.path.join(self.trash_dir, trash_name)
-
-                # если файл уже существует, добавляем номер
-                counter = 1
-                while os.path.exists(trash_path):
-                    trash_name = f"{trash_name}({counter})"
-                    trash_path = os.path.join(self.trash_dir, trash_name)
-                    counter += 1
-
+            if os.path.isfile(target_path) or (
+                os.path.isdir(target_path) and recursive
+            ):
                 try:
-                    if os.path.isfile(target_path):
-                        shutil.copy2(target_path, trash_path)
-                        backup_info.append(
-                            {"original_path": target_path, "trash_path": trash_path}
-                        )
-                    elif os.path.isdir(target_path) and recursive:
-                        shutil.copytree(target_path, trash_path)
-                        backup_info.append(
-                            {"original_path": target_path, "trash_path": trash_path}
-                        )
+                    trash_path = self.trash.reserve(target_path)
+                    backup_info.append(
+                        {"original_path": target_path, "trash_path": trash_path}
+                    )
                 except Exception as e:
                     print(f"Error creating backup: {e}")
 
@@ -101,18 +84,51 @@ class HistoryPlugin:
         if command not in ["cp", "mv", "rm"]:
             return
 
+        if command == "rm":
+            # в хранилище корзины кладем только то, что rm действительно перенес
+            stored = []
+            for file_info in backup_info or []:
+                if not os.path.lexists(file_info["trash_path"]):
+                    continue
+                try:
+                    trash_id = self.trash.store(
+                        file_info["trash_path"], file_info["original_path"]
+                    )
+                except Exception as e:
+                    print(f"Error creating backup: {e}")
+                    continue
+                stored.append(
+                    {"original_path": file_info["original_path"], "trash_id": trash_id}
+                )
+            if not stored:
+                return
+            backup_info = stored
+
         undo_info = {
             "command": command,
             "args": args.copy(),
             "cwd": os.getcwd(),
             "backup_info": backup_info,
         }
-        self.undo_stack.append(undo_info)
+        # у вытесненных из журнала операций удаленные файлы больше не нужны
+        for dropped in self.undo_journal.push(undo_info):
+            self.discard_backup(dropped)
+
+    def discard_backup(self, operation: dict) -> None:
+        """Освобождает корзину от файлов операции, которую уже не отменить"""
+        if operation["command"] != "rm":
+            return
+        for file_info in operation.get("backup_info") or []:
+            try:
+                self.trash.discard(file_info["trash_id"])
+            except Exception:
+                pass
 
     @log
     def show_history(self, args: list[str]) -> None:
         """Выводит историю команд"""
-        if not self.history:
+        total = len(self.journal)
+        if not total:
             print("No commands in history")
             return
 
@@ -121,52 +137,144 @@ class HistoryPlugin:
                 n = int(args[0])
                 if n <= 0:
                     raise ValueError("Number must be positive")
-                start_idx = max(0, len(self.history) - n)
-                history_to_show = self.history[start_idx:]
             except ValueError:
                 raise Exception("History requires a positive number argument")
+            # читаем только последние n записей
+            tail = self.journal.tail(n)
+            history_to_show: Iterable[str] = tail
+            start_number = total - len(tail) + 1
         else:
-            history_to_show = self.history
+            history_to_show = self.journal.entries()
+            start_number = 1
 
-        start_number = len(self.history) - len(history_to_show) + 1
-        for i, item in enumerate(history_to_show, start=start_number):
-            print(f"{i:4d}  {item['command']}")
+        for i, command in enumerate(history_to_show, start=start_number):
+            print(f"{i:4d}  {command}")
 
     @log
     def undo(self, args: list[str]) -> None:
-        """Отменяет последнюю операцию из списка cp, mv, rm"""
-        if not self.undo_stack:
+        """Отменяет последние операции из списка cp, mv, rm"""
+        if args == ["--list"]:
+            self.list_undo()
+            return
+
+        operations = self.undo_journal.undo(self.undo_count(args))
+        if not operations:
             print("No operations to undo")
             return
 
-        last_op = self.undo_stack.pop()
-        command = last_op["command"]
+        done = self.run_batch(operations, "undo", self.undo_operation)
+        # неотмененные операции возвращаем в журнал
+        if done < len(operations):
+            self.undo_journal.redo(operations[done:][::-1])
 
+    @log
+    def redo(self, args: list[str]) -> None:
+        """Повторяет последние отмененные операции"""
+        if len(args) > 1:
+            raise Exception("Usage: redo [N]")
+        count = self.parse_count(args[0]) if args else 1
+
+        operations = self.undo_journal.redo_stack[-count:][::-1]
+        if not operations:
+            print("No operations to redo")
+            return
+
+        done = self.run_batch(operations, "redo", self.redo_operation)
+        self.undo_journal.redo(operations[:done])
+
+    def undo_count(self, args: list[str]) -> int:
+        """Сколько операций отменить: undo [N | --to <id>]"""
+        if not args:
+            return 1
+        if len(args) == 1:
+            return self.parse_count(args[0])
+        if len(args) == 2 and args[0] == "--to":
+            try:
+                target = int(args[1])
+            except ValueError:
+                raise Exception(f"Invalid operation id: {args[1]}")
+            ids = [operation["id"] for operation in self.undo_stack]
+            if target not in ids:
+                raise Exception(f"No operation with id {target}")
+            return len(ids) - ids.index(target)
+        raise Exception("Usage: undo [N | --to <id> | --list]")
+
+    def parse_count(self, value: str) -> int:
+        """Положительное число операций"""
         try:
-            old_cwd = os.getcwd()
-            if last_op["cwd"] != old_cwd:
-                os.chdir(last_op["cwd"])
-
-            success = False
-            if command == "cp":
-                success = self.undo_cp(last_op)
-            elif command == "mv":
-                success = self.undo_mv(last_op)
-            elif command == "rm":
-                success = self.undo_rm(last_op)
-
-            if success:
-                print(f"Undo: {command} {' '.join(last_op['args'])}")
-            else:
-                print(f"Failed to undo {command}")
-                self.undo_stack.append(last_op)
+            count = int(value)
+            if count <= 0:
+                raise ValueError("Number must be positive")
+        except ValueError:
+            raise Exception(f"Invalid number of operations: {value}")
+        return count
+
+    def run_batch(
+        self, operations: list[dict], action: str, handler: Callable[[dict], bool]
+    ) -> int:
+        """Выполняет пачку отмен или повторов, останавливается на первой ошибке
+
+        Возвращает количество выполненных операций.
+        """
+        old_cwd = os.getcwd()
+        current_cwd = old_cwd
+        done = 0
+        try:
+            for operation in operations:
+                command = operation["command"]
+                # переходим в директорию операции, только если она сменилась
+                if operation["cwd"] != current_cwd:
+                    os.chdir(operation["cwd"])
+                    current_cwd = operation["cwd"]
 
-        except Exception as e:
-            print(f"Failed to undo {command}: {e}")
-            self.undo_stack.append(last_op)
+                try:
+                    success = handler(operation)
+                except Exception as e:
+                    print(f"Failed to {action} {command}: {e}")
+                    break
+                if not success:
+                    print(f"Failed to {action} {command}")
+                    break
+
+                line = f"{command} {' '.join(operation['args'])}".strip()
+                print(f"{action.capitalize()}: {line}")
+                done += 1
         finally:
-            if last_op["cwd"] != old_cwd:
+            if current_cwd != old_cwd:
                 os.chdir(old_cwd)
+        return done
+
+    def undo_operation(self, operation: dict) -> bool:
+        """Отмена одной операции"""
+        match operation["command"]:
+            case "cp":
+                return self.undo_cp(operation)
+            case "mv":
+                return self.undo_mv(operation)
+            case "rm":
+                return self.undo_rm(operation)
+        return False
+
+    def redo_operation(self, operation: dict) -> bool:
+        """Повтор одной операции"""
+        match operation["command"]:
+            case "cp":
+                return self.redo_cp(operation)
+            case "mv":
+                return self.redo_mv(operation)
+            case "rm":
+                return self.redo_rm(operation)
+        return False
+
+    def list_undo(self) -> None:
+        """Выводит операции, которые можно отменить, последняя - первой"""
+        if not self.undo_stack:
+            print("No operations to undo")
+            return
+
+        for operation in reversed(self.undo_stack):
+            line = f"{operation['command']} {' '.join(operation['args'])}".strip()
+            print(f"{operation['id']:4d}  {line}")
 
     def undo_cp(self, operation: dict) -> bool:
         """Отмена cp"""
@@ -176,7 +284,7 @@ class HistoryPlugin:
         source = None
         destination = None
         for arg in args:
-            if arg == "-r":
+            if arg in ("-r", "-v"):
                 continue
             elif source is None:
                 source = arg
@@ -246,14 +354,48 @@ class HistoryPlugin:
 
         success_count = 0
         for file_info in backup_info:
-            original_path = file_info.get("original_path")
-            trash_path = file_info.get("trash_path")
-
-            if trash_path and os.path.exists(trash_path):
-                try:
-                    shutil.move(trash_path, original_path)
-                    success_count += 1
-                except Exception as e:
-                    print(f"Error restoring {trash_path}: {e}")
+            original_path = file_info["original_path"]
+            try:
+                self.trash.restore(file_info["trash_id"], original_path)
+                success_count += 1
+            except Exception as e:
+                print(f"Error restoring {original_path}: {e}")
 
         return success_count > 0
+
+    def redo_cp(self, operation: dict) -> bool:
+        """Повтор cp"""
+        paths = [arg for arg in operation["args"] if arg not in ("-r", "-v")]
+        if len(paths) != 2:
+            return False
+
+        source, destination = paths
+        if os.path.isdir(source):
+            if "-r" not in operation["args"]:
+                return False
+            shutil.copytree(source, destination, symlinks=True)
+        else:
+            shutil.copy2(source, destination)
+        return True
+
+    def redo_mv(self, operation: dict) -> bool:
+        """Повтор mv"""
+        args = operation["args"]
+        if len(args) != 2 or not os.path.lexists(args[0]):
+            return False
+
+        shutil.move(args[0], args[1])
+        return True
+
+    def redo_rm(self, operation: dict) -> bool:
+        """Повтор rm: файлы снова уходят в корзину"""
+        backup_info = operation["backup_info"]
+        if not all(os.path.lexists(info["original_path"]) for info in backup_info):
+            return False
+
+        for file_info in backup_info:
+            original_path = file_info["original_path"]
+            trash_path = self.trash.reserve(original_path)
+            trash.move(original_path, trash_path)
+            file_info["trash_id"] = self.trash.store(trash_path, original_path)
+        return True
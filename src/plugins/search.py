@@ -1,8 +1,219 @@
+import fnmatch
 import logging
+import multiprocessing
 import os
 import re
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 from src.logger import log
+from src.output import output
+from src.trigram import BINARY_SNIFF_SIZE, INDEX_NAME, TrigramIndex, pattern_trigrams
+
+# сколько файлов отдаем воркеру за одну задачу
+FILES_PER_TASK = 32
+
+# размер блока при чтении файла
+CHUNK_SIZE = 1024 * 1024
+
+# метасимволы регулярных выражений
+REGEX_META = set(".^$*+?{}[]\\|()")
+
+# ключи grep, за которыми следует значение
+VALUE_OPTIONS = ("-j", "--max-filesize", "--include", "--exclude", "--exclude-dir")
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+GREP_USAGE = (
+    "Usage: grep <pattern> <path> [-r] [-i] [-j N] [--threads] [--no-index]"
+    " [--max-filesize SIZE] [--include GLOB] [--exclude GLOB] [--exclude-dir GLOB]"
+)
+
+# процессы -j не форкаются из оболочки: к этому моменту уже работает поток
+# журнала, и копия его захваченной блокировки осталась бы в дочернем процессе
+WORKER_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# конструкции, которые ведут себя по-разному в строке и в целом блоке
+LINE_ONLY_TOKENS = ("\\A", "\\Z", "(?=", "(?!", "(?<")
+
+
+def matches_any(name: str, patterns: list[str]) -> bool:
+    """Проверяет имя по списку glob-шаблонов"""
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def literal_bytes(regex: re.Pattern) -> bytes | None:
+    """Возвращает шаблон в байтах, если в нем нет метасимволов"""
+    if regex.flags & re.IGNORECASE or not regex.pattern:
+        return None
+    if any(char in REGEX_META for char in regex.pattern):
+        return None
+    return regex.pattern.encode("utf-8")
+
+
+def read_blocks(file_path: str) -> Iterator[bytes]:
+    """Читает файл крупными блоками, разрезая их только по концам строк
+
+    Двоичный файл (нулевой байт в начале, как у GNU grep) не читается дальше
+    первого блока и не дает ни одного блока.
+    """
+    with open(file_path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        # проверяем сразу прочитанное, пока не начали копить строки
+        if chunk.find(b"\0", 0, BINARY_SNIFF_SIZE) != -1:
+            return
+
+        # строку длиннее блока копим частями и склеиваем один раз
+        parts: list[bytes] = []
+        while chunk:
+            cut = chunk.rfind(b"\n")
+            if cut == -1:
+                # строка длиннее блока - читаем дальше
+                parts.append(chunk)
+            else:
+                parts.append(chunk[: cut + 1])
+                yield b"".join(parts)
+                parts = [chunk[cut + 1 :]] if cut + 1 < len(chunk) else []
+            chunk = f.read(CHUNK_SIZE)
+
+        if parts:
+            yield b"".join(parts)
+
+
+def scan_file(file_path: str, regex: re.Pattern) -> list[str]:
+    """Ищет совпадения в одном файле и возвращает строки вывода"""
+    result: list[str] = []
+    literal = literal_bytes(regex)
+    # шаблоны с привязкой к началу/концу строки и просмотром вокруг
+    # проверяем построчно, остальные - поиском сразу по всему блоку
+    per_line = any(token in regex.pattern for token in LINE_ONLY_TOKENS)
+    block_regex = re.compile(regex.pattern, regex.flags | re.MULTILINE)
+
+    line_num = 1
+    try:
+        for block in read_blocks(file_path):
+            if literal is not None and b"\r" not in block:
+                line_num = scan_literal(file_path, block, literal, line_num, result)
+                continue
+
+            text = block.decode("utf-8", errors="ignore")
+            if "\r" in text:
+                # как в текстовом режиме: \r\n и \r считаются концом строки
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+            if per_line:
+                # строки делим только по \n, как текстовый режим open()
+                lines = text.split("\n")
+                tail = lines.pop()
+                for line in [line + "\n" for line in lines] + ([tail] if tail else []):
+                    if regex.search(line):
+                        result.append(f"{file_path}:{line_num}: {line.rstrip()}")
+                    line_num += 1
+            else:
+                line_num = scan_text(
+                    file_path, text, regex, block_regex, line_num, result
+                )
+    except Exception:
+        pass
+    return result
+
+
+def scan_literal(
+    file_path: str, block: bytes, literal: bytes, line_num: int, result: list[str]
+) -> int:
+    """Ищет подстроку через bytes.find и декодирует только найденные строки"""
+    counted = 0
+    pos = block.find(literal)
+    while pos != -1:
+        line_start = block.rfind(b"\n", 0, pos) + 1
+        line_end = block.find(b"\n", pos)
+        if line_end == -1:
+            line_end = len(block)
+
+        line_num += block.count(b"\n", counted, line_start)
+        counted = line_start
+        line = block[line_start:line_end].decode("utf-8", errors="ignore")
+        result.append(f"{file_path}:{line_num}: {line.rstrip()}")
+
+        pos = block.find(literal, line_end + 1)
+
+    return line_num + block.count(b"\n", counted)
+
+
+def scan_text(
+    file_path: str,
+    text: str,
+    regex: re.Pattern,
+    block_regex: re.Pattern,
+    line_num: int,
+    result: list[str],
+) -> int:
+    """Ищет кандидатов по всему блоку и проверяет найденные строки"""
+    counted = 0
+    match = block_regex.search(text)
+    while match:
+        pos = match.start()
+        line_start = text.rfind("\n", 0, pos) + 1
+        if line_start == len(text):
+            # пустое совпадение после последнего перевода строки
+            break
+        line_end = text.find("\n", pos)
+        line_end = len(text) if line_end == -1 else line_end + 1
+
+        line_num += text.count("\n", counted, line_start)
+        counted = line_start
+        line = text[line_start:line_end]
+
+        # совпадение могло захватить перевод строки - проверяем строку целиком
+        if regex.search(line):
+            result.append(f"{file_path}:{line_num}: {line.rstrip()}")
+
+        if line_end >= len(text):
+            break
+        match = block_regex.search(text, line_end)
+
+    return line_num + text.count("\n", counted)
+
+
+def scan_files(file_paths: list[str], regex: re.Pattern) -> list[str]:
+    """Задача воркера: поиск в пачке файлов с сохранением порядка"""
+    result = []
+    for file_path in file_paths:
+        result.extend(scan_file(file_path, regex))
+    return result
+
+
+@dataclass
+class GrepOptions:
+    """Параметры обхода файлов для grep"""
+
+    jobs: int = 1
+    use_threads: bool = False
+    max_filesize: int | None = None
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+    exclude_dir: list[str] = field(default_factory=list)
+    use_index: bool = True
+
+
+def parse_size(text: str) -> int:
+    """Переводит размер вида 512, 10K, 5M, 1G в байты"""
+    multiplier = 1
+    suffix = text[-1:].upper()
+    if suffix in SIZE_SUFFIXES:
+        multiplier = SIZE_SUFFIXES[suffix]
+        text = text[:-1]
+    try:
+        size = int(text) * multiplier
+    except ValueError:
+        raise Exception(f"Invalid size: {text}")
+    if size < 0:
+        raise Exception(f"Invalid size: {text}")
+    return size
 
 
 class SearchPlugin:
@@ -16,13 +227,14 @@ class SearchPlugin:
     def grep(self, args: list[str]) -> None:
         """Поиск по содержимому файлов"""
         if len(args) < 2:
-            raise Exception("Usage: grep <pattern> <path> [-r] [-i]")
+            raise Exception(GREP_USAGE)
 
         # парсим аргументы
         pattern = args[0]
         path = args[1]
         recursive = "-r" in args
         ignore_case = "-i" in args
+        options = self.parse_options(args[2:])
 
         # настраиваем регулярное выражение
         flags = re.IGNORECASE if ignore_case else 0
@@ -36,38 +248,202 @@ class SearchPlugin:
             self.search_in_file(path, regex)
         elif os.path.isdir(path):
             if recursive:
-                self.search_in_directory_recursive(path, regex)
+                self.search_in_directory_recursive(path, regex, options)
             else:
-                self.search_in_directory(path, regex)
+                self.search_in_directory(path, regex, options)
         else:
             raise Exception(f"Path not found: {path}")
 
+    def parse_options(self, args: list[str]) -> GrepOptions:
+        """Разбирает ключи grep со значениями"""
+        options = GrepOptions(
+            use_threads="--threads" in args, use_index="--no-index" not in args
+        )
+
+        for i, arg in enumerate(args):
+            if arg not in VALUE_OPTIONS:
+                continue
+            if i + 1 >= len(args):
+                raise Exception(f"grep {arg} requires a value")
+            value = args[i + 1]
+
+            if arg == "-j":
+                try:
+                    options.jobs = int(value)
+                    if options.jobs <= 0:
+                        raise ValueError
+                except ValueError:
+                    raise Exception("grep -j requires a positive number of workers")
+            elif arg == "--max-filesize":
+                options.max_filesize = parse_size(value)
+            elif arg == "--include":
+                options.include.append(value)
+            elif arg == "--exclude":
+                options.exclude.append(value)
+            elif arg == "--exclude-dir":
+                options.exclude_dir.append(value)
+
+        return options
+
+    @log
+    def index(self, args: list[str]) -> None:
+        """Построение, обновление и статистика индекса триграмм"""
+        if not args or args[0] not in ("build", "update", "stats") or len(args) > 2:
+            raise Exception("Usage: index build|update|stats [directory]")
+
+        action = args[0]
+        directory = args[1] if len(args) == 2 else "."
+        if not os.path.isdir(directory):
+            raise Exception(f"Not a directory: {directory}")
+
+        if action == "stats":
+            index = TrigramIndex.load(directory)
+            if index is None:
+                raise Exception(f"No index in {directory}")
+            for key, value in index.stats().items():
+                print(f"{key}: {value}")
+            return
+
+        if action == "build":
+            index = TrigramIndex(directory)
+        else:
+            index = TrigramIndex.load(directory) or TrigramIndex(directory)
+
+        added, updated, removed = index.update()
+        index.save()
+        print(
+            f"Index {index.root}: {added} added, {updated} updated, {removed} removed"
+        )
+
     def search_in_file(self, file_path: str, regex: re.Pattern) -> None:
         """Поиск в одном файле"""
-        try:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                for line_num, line in enumerate(f, 1):
-                    if regex.search(line):
-                        print(f"{file_path}:{line_num}: {line.rstrip()}")
-        except Exception:
-            pass
+        for line in scan_file(file_path, regex):
+            output.line(line)
 
-    def search_in_directory(self, directory: str, regex: re.Pattern) -> None:
+    def search_in_directory(
+        self, directory: str, regex: re.Pattern, options: GrepOptions | None = None
+    ) -> None:
         """Поиск в директории"""
+        options = options or GrepOptions()
+        files: Iterable[str] = self.iter_directory(directory, options)
+        if options.use_index:
+            files = self.filter_by_index(directory, regex, files)
+        self.search_in_files(files, regex, options)
+
+    def search_in_directory_recursive(
+        self, directory: str, regex: re.Pattern, options: GrepOptions | None = None
+    ) -> None:
+        """Рекурсивный поиск в директории и поддиректориях"""
+        options = options or GrepOptions()
+        files: Iterable[str] = self.walk_directory(directory, options)
+        if options.use_index:
+            files = self.filter_by_index(directory, regex, files)
+        self.search_in_files(files, regex, options)
+
+    def iter_directory(self, directory: str, options: GrepOptions) -> Iterator[str]:
+        """Файлы директории без вложенных"""
         try:
             for item in os.listdir(directory):
                 item_path = os.path.join(directory, item)
-                if os.path.isfile(item_path):
-                    self.search_in_file(item_path, regex)
+                if os.path.isfile(item_path) and self.accept_file(item_path, options):
+                    yield item_path
         except Exception:
             pass
 
-    def search_in_directory_recursive(self, directory: str, regex: re.Pattern) -> None:
-        """Рекурсивный поиск в директории и поддиректориях"""
+    def walk_directory(self, directory: str, options: GrepOptions) -> Iterator[str]:
+        """Файлы директории и всех поддиректорий в порядке обхода"""
         try:
-            for path, _, files in os.walk(directory):
+            for path, dirs, files in os.walk(directory):
+                # исключенные директории убираем из обхода, в них не заходим
+                if options.exclude_dir:
+                    dirs[:] = [
+                        name
+                        for name in dirs
+                        if not matches_any(name, options.exclude_dir)
+                    ]
                 for file in files:
                     file_path = os.path.join(path, file)
-                    self.search_in_file(file_path, regex)
+                    if self.accept_file(file_path, options):
+                        yield file_path
         except Exception:
             pass
+
+    def filter_by_index(
+        self, directory: str, regex: re.Pattern, files: Iterable[str]
+    ) -> Iterable[str]:
+        """Отбрасывает файлы, в которых по индексу триграмм нет совпадений"""
+        ignore_case = bool(regex.flags & re.IGNORECASE)
+        trigrams = pattern_trigrams(regex.pattern, ignore_case)
+        if not trigrams:
+            # шаблон не сводится к триграммам - индекс не читаем, полный поиск
+            return files
+
+        index = TrigramIndex.find(directory)
+        if index is None:
+            return files
+
+        candidates = index.candidates(trigrams)
+        return (path for path in files if not index.can_skip(path, candidates))
+
+    def accept_file(self, file_path: str, options: GrepOptions) -> bool:
+        """Проверяет файл по шаблонам имени и размеру"""
+        name = os.path.basename(file_path)
+        if name in (INDEX_NAME, INDEX_NAME + ".tmp"):
+            return False
+        if options.include and not matches_any(name, options.include):
+            return False
+        if options.exclude and matches_any(name, options.exclude):
+            return False
+        if options.max_filesize is not None:
+            try:
+                if os.path.getsize(file_path) > options.max_filesize:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def search_in_files(
+        self,
+        file_paths: Iterable[str],
+        regex: re.Pattern,
+        options: GrepOptions | None = None,
+    ) -> None:
+        """Поиск по списку файлов, при -j N - в пуле воркеров"""
+        options = options or GrepOptions()
+        jobs = options.jobs
+        if jobs == 1:
+            for file_path in file_paths:
+                self.search_in_file(file_path, regex)
+            return
+
+        executor: Executor
+        if options.use_threads:
+            executor = ThreadPoolExecutor(max_workers=jobs)
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+            )
+
+        # держим ограниченное окно задач и выводим их результаты в порядке обхода
+        pending: deque = deque()
+        with executor:
+            for batch in self.batches(file_paths):
+                pending.append(executor.submit(scan_files, batch, regex))
+                if len(pending) >= jobs * 4:
+                    for line in pending.popleft().result():
+                        output.line(line)
+            while pending:
+                for line in pending.popleft().result():
+                    output.line(line)
+
+    def batches(self, file_paths: Iterable[str]) -> Iterator[list[str]]:
+        """Разбивает поток файлов на пачки для воркеров"""
+        batch = []
+        for file_path in file_paths:
+            batch.append(file_path)
+            if len(batch) == FILES_PER_TASK:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
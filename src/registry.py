@@ -0,0 +1,124 @@
+import importlib
+import logging
+from collections.abc import Callable
+from typing import NamedTuple
+
+# группа точек входа, через которую сторонние пакеты добавляют команды
+ENTRY_POINT_GROUP = "lab2.commands"
+
+TERMINAL = "src.terminal:Terminal"
+HISTORY = "src.plugins.history:HistoryPlugin"
+ARCHIVE = "src.plugins.archive:ArchivePlugin"
+SEARCH = "src.plugins.search:SearchPlugin"
+
+
+class CommandSpec(NamedTuple):
+    """Описание команды: кто ее выполняет и как ее отменять"""
+
+    name: str
+    # класс-исполнитель в виде "модуль:Класс"
+    owner: str
+    # метод класса, по умолчанию совпадает с именем команды
+    method: str | None = None
+    # операцию можно отменить через undo
+    undoable: bool = False
+    # перед выполнением нужно зарезервировать место в корзине,
+    # резервации передаются исполнителю аргументом backup_info
+    needs_backup: bool = False
+
+
+BUILTIN_COMMANDS = [
+    CommandSpec("ls", TERMINAL),
+    CommandSpec("cd", TERMINAL),
+    CommandSpec("cat", TERMINAL),
+    CommandSpec("cp", TERMINAL, undoable=True),
+    CommandSpec("mv", TERMINAL, undoable=True),
+    CommandSpec("rm", TERMINAL, undoable=True, needs_backup=True),
+    CommandSpec("stats", TERMINAL),
+    CommandSpec("zip", ARCHIVE),
+    CommandSpec("unzip", ARCHIVE),
+    CommandSpec("tar", ARCHIVE),
+    CommandSpec("untar", ARCHIVE),
+    CommandSpec("extract", ARCHIVE),
+    CommandSpec("grep", SEARCH),
+    CommandSpec("index", SEARCH),
+    CommandSpec("history", HISTORY, method="show_history"),
+    CommandSpec("undo", HISTORY),
+    CommandSpec("redo", HISTORY),
+]
+
+
+class CommandRegistry:
+    """Таблица команд: имя -> исполнитель, модули загружаются при первом вызове"""
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        instances: dict[str, object] | None = None,
+        factories: dict[str, Callable[[], object]] | None = None,
+    ) -> None:
+        """Встроенные команды, уже созданные исполнители и способы создать их"""
+        self.logger = logger
+        self.specs = {spec.name: spec for spec in BUILTIN_COMMANDS}
+        self._instances = dict(instances or {})
+        # исполнители, которые уже кто-то создает лениво, берем у него
+        self._factories = dict(factories or {})
+        self._handlers: dict[str, Callable[..., None]] = {}
+        self._entry_points_loaded = False
+
+    def register(self, spec: CommandSpec) -> None:
+        """Добавляет или заменяет команду"""
+        self.specs[spec.name] = spec
+        self._handlers.pop(spec.name, None)
+
+    def get(self, name: str) -> CommandSpec | None:
+        """Описание команды, None если такой нет"""
+        spec = self.specs.get(name)
+        if spec is None and not self._entry_points_loaded:
+            # сторонние команды ищем, только когда встроенной не нашлось
+            self.load_entry_points()
+            spec = self.specs.get(name)
+        return spec
+
+    def load_entry_points(self) -> None:
+        """Регистрирует команды из точек входа вида модуль:Класс.метод"""
+        from importlib import metadata
+
+        self._entry_points_loaded = True
+        for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP):
+            module_name, _, attr = entry_point.value.partition(":")
+            class_name, _, method = attr.rpartition(".")
+            if not module_name or not class_name or not method:
+                self.logger.error(
+                    "ERROR: Bad command entry point: %s = %s",
+                    entry_point.name,
+                    entry_point.value,
+                )
+                continue
+            # встроенные команды сторонние пакеты не подменяют
+            self.specs.setdefault(
+                entry_point.name,
+                CommandSpec(entry_point.name, f"{module_name}:{class_name}", method),
+            )
+
+    def handler(self, spec: CommandSpec) -> Callable[..., None]:
+        """Метод, выполняющий команду"""
+        handler = self._handlers.get(spec.name)
+        if handler is None:
+            handler = getattr(self.instance(spec.owner), spec.method or spec.name)
+            self._handlers[spec.name] = handler
+        return handler
+
+    def instance(self, owner: str) -> object:
+        """Исполнитель команд, создается при первом обращении"""
+        instance = self._instances.get(owner)
+        if instance is None:
+            factory = self._factories.get(owner)
+            if factory is not None:
+                instance = factory()
+            else:
+                module_name, _, class_name = owner.partition(":")
+                module = importlib.import_module(module_name)
+                instance = getattr(module, class_name)(self.logger)
+            self._instances[owner] = instance
+        return instance
@@ -0,0 +1,114 @@
+import json
+import os
+import stat
+
+from src.trash import file_hash
+
+# член архива со списком удаленных файлов и ссылкой на предыдущий снимок
+SNAPSHOT_MEMBER = ".snapshot.json"
+
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    """Состояние директории на момент последнего снимка tar -g
+
+    Хранит для каждого файла размер, mtime и, если нужно, хеш, а также
+    цепочку архивов: полный снимок и инкрементные после него.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Путь файла манифеста, сам файл читается в load()"""
+        self.path = path
+        self.root: str | None = None
+        # относительный путь -> {"size", "mtime_ns", "hash"}
+        self.files: dict[str, dict] = {}
+        self.directories: list[str] = []
+        self.chain: list[str] = []
+
+    def load(self) -> "Manifest":
+        """Читает манифест, если он есть"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError):
+            raise Exception(f"Bad manifest: {self.path}")
+
+        if data.get("version") != MANIFEST_VERSION:
+            raise Exception(f"Unsupported manifest version: {self.path}")
+        self.root = data["root"]
+        self.files = data["files"]
+        self.directories = data["directories"]
+        self.chain = data["chain"]
+        return self
+
+    def save(self) -> None:
+        """Атомарно записывает манифест"""
+        data = {
+            "version": MANIFEST_VERSION,
+            "root": self.root,
+            "files": self.files,
+            "directories": self.directories,
+            "chain": self.chain,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def scan(
+        self, root: str, skip: set[str], use_hash: bool = False
+    ) -> tuple[dict[str, dict], list[str], list[str], list[str]]:
+        """Сравнивает директорию с манифестом
+
+        Возвращает новое состояние файлов, директории, изменившиеся
+        файлы и удаленные пути. skip - пути, которые не снимаются.
+        """
+        files: dict[str, dict] = {}
+        directories: list[str] = []
+        changed: list[str] = []
+
+        for path, dirs, names in os.walk(root):
+            # ссылки на директории снимаются как ссылки
+            links = [name for name in dirs if os.path.islink(os.path.join(path, name))]
+            dirs[:] = sorted(name for name in dirs if name not in links)
+            rel_dir = os.path.relpath(path, root)
+            prefix = "" if rel_dir == "." else rel_dir.replace(os.sep, "/") + "/"
+            if prefix:
+                directories.append(prefix[:-1])
+
+            for name in sorted(names + links):
+                file_path = os.path.join(path, name)
+                if os.path.realpath(file_path) in skip:
+                    continue
+                info = os.lstat(file_path)
+                rel = prefix + name
+                record: dict[str, int | str] = {
+                    "size": info.st_size,
+                    "mtime_ns": info.st_mtime_ns,
+                }
+                previous = self.files.get(rel)
+
+                if (
+                    previous is not None
+                    and previous["size"] == record["size"]
+                    and previous["mtime_ns"] == record["mtime_ns"]
+                ):
+                    # размер и время совпали - файл не трогали
+                    if "hash" in previous:
+                        record["hash"] = previous["hash"]
+                elif use_hash and stat.S_ISREG(info.st_mode):
+                    record["hash"] = file_hash(file_path)
+                    # если изменилось только время, хеш совпадет с прежним
+                    if previous is None or previous.get("hash") != record["hash"]:
+                        changed.append(rel)
+                else:
+                    changed.append(rel)
+                files[rel] = record
+
+        present = set(directories)
+        deleted = [rel for rel in self.files if rel not in files]
+        deleted += [rel for rel in self.directories if rel not in present]
+        return files, directories, changed, sorted(deleted)
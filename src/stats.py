@@ -0,0 +1,185 @@
+import json
+import math
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore[assignment]
+
+# основание логарифмических корзин: перцентиль завышается не больше чем на 10%
+BUCKET_BASE = 1.1
+
+# меньшие значения попадают в одну корзину
+MIN_VALUE = 1e-9
+
+# перцентили, которые показывает stats
+QUANTILES = (0.5, 0.95, 0.99)
+
+# размер блока, в котором getrusage считает ввод-вывод
+RUSAGE_BLOCK = 512
+
+
+def io_counters() -> tuple[int, int]:
+    """Сколько байт процесс прочитал и записал с момента запуска
+
+    Значения приближенные: счетчики общие для процесса, поэтому в замер
+    команды попадают фоновые потоки (журнал, запись лога) и само чтение
+    /proc/self/io.
+    """
+    try:
+        with open("/proc/self/io", "rb") as f:
+            fields = dict(line.split(b":", 1) for line in f if b":" in line)
+        return int(fields[b"rchar"]), int(fields[b"wchar"])
+    except (OSError, KeyError, ValueError):
+        pass
+
+    # без /proc остаются только блоки, прочитанные с диска
+    if resource is None:
+        return 0, 0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_inblock * RUSAGE_BLOCK, usage.ru_oublock * RUSAGE_BLOCK
+
+
+class Histogram:
+    """Гистограмма с логарифмическими корзинами"""
+
+    def __init__(self) -> None:
+        """Пустая гистограмма"""
+        # номер корзины -> количество значений
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        """Добавляет значение"""
+        bucket = math.ceil(math.log(max(value, MIN_VALUE), BUCKET_BASE))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Приближенный перцентиль: верхняя граница корзины"""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(BUCKET_BASE**bucket, self.max)
+        return self.max
+
+
+class CommandStats:
+    """Замеры одной команды"""
+
+    def __init__(self) -> None:
+        """Пустые счетчики"""
+        self.wall = Histogram()
+        self.cpu = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.errors = 0
+
+
+class Stats:
+    """Статистика выполнения команд в памяти процесса"""
+
+    def __init__(self) -> None:
+        """Пустая статистика"""
+        self.commands: dict[str, CommandStats] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        command: str,
+        wall: float,
+        cpu: float,
+        read_bytes: int,
+        write_bytes: int,
+        failed: bool = False,
+    ) -> None:
+        """Добавляет замер выполнения команды"""
+        with self._lock:
+            item = self.commands.get(command)
+            if item is None:
+                item = self.commands[command] = CommandStats()
+            item.wall.add(wall)
+            item.cpu += cpu
+            item.read_bytes += read_bytes
+            item.write_bytes += write_bytes
+            item.errors += failed
+
+    def snapshot(self) -> dict:
+        """Сводка по командам: число вызовов, перцентили и счетчики"""
+        with self._lock:
+            result = {}
+            for command in sorted(self.commands):
+                item = self.commands[command]
+                result[command] = {
+                    "count": item.wall.count,
+                    "errors": item.errors,
+                    "wall_seconds": {
+                        f"p{round(q * 100)}": item.wall.percentile(q) for q in QUANTILES
+                    },
+                    "wall_seconds_sum": item.wall.total,
+                    "wall_seconds_max": item.wall.max,
+                    "cpu_seconds": item.cpu,
+                    "read_bytes": item.read_bytes,
+                    "write_bytes": item.write_bytes,
+                }
+            return result
+
+    def to_json(self) -> str:
+        """Сводка в формате JSON"""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Сводка в текстовом формате Prometheus"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP shell_command_duration_seconds Command wall time.",
+            "# TYPE shell_command_duration_seconds summary",
+        ]
+        for command, item in snapshot.items():
+            label = f'command="{command}"'
+            for q in QUANTILES:
+                value = item["wall_seconds"][f"p{round(q * 100)}"]
+                lines.append(
+                    f'shell_command_duration_seconds{{{label},quantile="{q}"}} {value}'
+                )
+            lines.append(
+                f"shell_command_duration_seconds_sum{{{label}}} "
+                f"{item['wall_seconds_sum']}"
+            )
+            lines.append(
+                f"shell_command_duration_seconds_count{{{label}}} {item['count']}"
+            )
+
+        counters = [
+            ("errors", "errors_total", "Failed command runs."),
+            ("cpu_seconds", "cpu_seconds_total", "Command CPU time."),
+            (
+                "read_bytes",
+                "read_bytes_total",
+                "Approximate bytes read by commands (process-wide counters).",
+            ),
+            (
+                "write_bytes",
+                "write_bytes_total",
+                "Approximate bytes written by commands (process-wide counters).",
+            ),
+        ]
+        for key, name, help_text in counters:
+            lines.append(f"# HELP shell_command_{name} {help_text}")
+            lines.append(f"# TYPE shell_command_{name} counter")
+            for command, item in snapshot.items():
+                lines.append(f'shell_command_{name}{{command="{command}"}} {item[key]}')
+        return "\n".join(lines) + "\n"
+
+
+stats = Stats()
@@ -1,20 +1,29 @@
+import codecs
 import logging
 import os
 import shutil
 import stat
 from datetime import datetime
+from functools import cached_property, partial
+from typing import TYPE_CHECKING, BinaryIO
 
+from src import trash
 from src.logger import log
-from src.plugins.archive import ArchivePlugin
-from src.plugins.search import SearchPlugin
+from src.output import format_size, output, progress_line, progress_summary
+from src.stats import stats as command_stats
 
-# настройка логирования
-logging.basicConfig(
-    filename=os.path.join(os.path.dirname(__file__), "shell.log"),
-    level=logging.INFO,
-    format="[%(asctime)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+if TYPE_CHECKING:
+    from src.plugins.archive import ArchivePlugin
+    from src.plugins.search import SearchPlugin
+
+# размер блока при выводе файла
+CAT_CHUNK_SIZE = 64 * 1024
+
+# ширина колонки размера в потоковом ls -l, где максимум заранее неизвестен
+STREAM_SIZE_WIDTH = 12
+
+# файлы, содержимое которых ls показывает как директорию
+ARCHIVE_SUFFIXES = (".zip", ".tar.gz")
 
 
 class Terminal:
@@ -24,50 +33,92 @@ class Terminal:
         """Инициализация логгера"""
         self.logger = logging.getLogger()
 
-        self.archive_plugin = ArchivePlugin(self.logger)
-        self.search_plugin = SearchPlugin(self.logger)
+    # плагины и их зависимости загружаются при первом обращении
+    @cached_property
+    def archive_plugin(self) -> "ArchivePlugin":
+        """Плагин для работы с архивами"""
+        from src.plugins.archive import ArchivePlugin
+
+        return ArchivePlugin(self.logger)
+
+    @cached_property
+    def search_plugin(self) -> "SearchPlugin":
+        """Плагин поиска"""
+        from src.plugins.search import SearchPlugin
+
+        return SearchPlugin(self.logger)
 
     @log
     def ls(self, args: list[str]) -> None:
         """Выводит содержимое директории"""
         path = "."
-        detailed = False
+        paths = []
+        flags = set()
 
-        # парсим аргументы
+        # парсим аргументы: -l, -a, -S, -t и их сочетания вроде -la
         for arg in args:
-            if arg == "-l":
-                detailed = True
+            if arg == "--stream":
+                flags.add("stream")
+            elif arg.startswith("-") and len(arg) > 1:
+                for flag in arg[1:]:
+                    if flag not in "laSt":
+                        raise Exception(f"Unknown option: -{flag}")
+                    flags.add(flag)
             else:
-                path = arg
+                paths.append(arg)
 
         # проверка на валидность
-        if len(args) > 2 or (len(args) == 2 and not detailed):
+        if len(paths) > 1:
             raise Exception("Too many arguments")
+        if paths:
+            path = paths[0]
+
+        detailed = "l" in flags
+        show_all = "a" in flags
+        sort_key = "S" if "S" in flags else "t" if "t" in flags else None
+        is_archive = path.endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+        if "stream" in flags and not is_archive:
+            if sort_key:
+                raise Exception("--stream cannot be combined with -S or -t")
+            self.ls_stream(path, detailed, show_all)
+            return
 
-        # исполнение команды ls
-        files = os.listdir(path)
-        files = [i for i in files if i[0] != "."]
+        # исполнение команды ls: один проход scandir, stat берется из DirEntry
+        entries: list[tuple[str, os.stat_result]] = []
+        names: list[str] = []
+        if is_archive:
+            # содержимое архива читается из его каталога или индекса
+            for name, info in self.archive_plugin.members(path):
+                if name and (show_all or name[0] != "."):
+                    entries.append((name, info))
+        else:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if show_all or entry.name[0] != ".":
+                        # stat нужен только для -l и сортировки
+                        if detailed or sort_key:
+                            entries.append((entry.name, self.entry_stat(entry)))
+                        else:
+                            names.append(entry.name)
 
         # если директория пустая - выходим
-        if not files:
+        if not entries and not names:
             return
 
+        if sort_key == "S":
+            entries.sort(key=lambda item: item[1].st_size, reverse=True)
+        elif sort_key == "t":
+            entries.sort(key=lambda item: item[1].st_mtime, reverse=True)
+
+        files = names or [name for name, _ in entries]
+
         if detailed:
             # находим максимальную длину размера файла
-            max_size_len = 0
-            for file in files:
-                file_path = os.path.join(path, file)
-                info = os.stat(file_path)
-                max_size_len = max(max_size_len, len(str(info.st_size)))
+            max_size_len = max(len(str(info.st_size)) for _, info in entries)
 
             # вывод -l
-            for file in files:
-                file_path = os.path.join(path, file)
-                info = os.stat(file_path)
-                size = info.st_size
-                date = datetime.fromtimestamp(info.st_mtime).strftime("%b %d %H:%M")
-                permissions = stat.filemode(info.st_mode)
-                print(f"{permissions} {size:>{max_size_len}} {date} {file}")
+            for file, info in entries:
+                output.line(self.format_detailed(file, info, max_size_len))
         else:
             # ширина терминала
             try:
@@ -100,7 +151,35 @@ class Terminal:
                     if index < len(formatted_files):
                         # добавляем файл с выравниванием
                         line += f"{formatted_files[index]:<{max_name_length}}"
-                print(line)
+                output.line(line)
+
+    def entry_stat(self, entry: os.DirEntry) -> os.stat_result:
+        """stat элемента директории, для битых ссылок - самой ссылки"""
+        try:
+            return entry.stat()
+        except OSError:
+            return entry.stat(follow_symlinks=False)
+
+    def format_detailed(self, file: str, info: os.stat_result, size_len: int) -> str:
+        """Строка вывода ls -l"""
+        size = info.st_size
+        date = datetime.fromtimestamp(info.st_mtime).strftime("%b %d %H:%M")
+        permissions = stat.filemode(info.st_mode)
+        return f"{permissions} {size:>{size_len}} {date} {file}"
+
+    def ls_stream(self, path: str, detailed: bool, show_all: bool) -> None:
+        """Выводит элементы по мере чтения директории, без сортировки и колонок"""
+        with os.scandir(path) as it:
+            for entry in it:
+                if not show_all and entry.name[0] == ".":
+                    continue
+                if detailed:
+                    info = self.entry_stat(entry)
+                    output.line(
+                        self.format_detailed(entry.name, info, STREAM_SIZE_WIDTH)
+                    )
+                else:
+                    output.line(entry.name)
 
     @log
     def cd(self, args: list[str]) -> None:
@@ -127,40 +206,111 @@ class Terminal:
     @log
     def cat(self, args: list[str]) -> None:
         """Выводит содержимое файла"""
-        if len(args) != 1:
+        number_lines = False
+        byte_range = None
+        files = []
+
+        # парсим аргументы
+        i = 0
+        while i < len(args):
+            if args[i] == "-n":
+                number_lines = True
+            elif args[i] == "--range":
+                if i + 1 >= len(args):
+                    raise Exception("Option --range requires a value")
+                byte_range = args[i + 1]
+                i += 1
+            else:
+                files.append(args[i])
+            i += 1
+
+        if len(files) != 1:
             raise Exception("cat requires exactly one argument")
 
-        filename = args[0]
+        filename = files[0]
+
+        # читаем и выводим содержимое блоками, не загружая файл целиком
+        with open(filename, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            start, end = self.parse_range(byte_range, size)
+
+            if not number_lines and output.sendfile(file.fileno(), start, end - start):
+                return
+
+            file.seek(start)
+            self.stream_file(file, end - start, number_lines)
 
-        # читаем и выводим содержимое
-        with open(filename, "r", encoding="utf-8") as file:
-            print(file.read(), end="")
+    def parse_range(self, byte_range: str | None, size: int) -> tuple[int, int]:
+        """Границы диапазона байт START-END, START- или -LAST (конец включительно)"""
+        if byte_range is None:
+            return 0, size
+
+        first, sep, last = byte_range.partition("-")
+        try:
+            if not sep or (not first and not last):
+                raise ValueError
+            if not first:
+                start, end = max(size - int(last), 0), size
+            else:
+                start = int(first)
+                end = int(last) + 1 if last else size
+            if start < 0 or end < start:
+                raise ValueError
+        except ValueError:
+            raise Exception(f"Invalid range: {byte_range}")
+
+        return min(start, size), min(end, size)
+
+    def stream_file(self, file: BinaryIO, count: int, number_lines: bool) -> None:
+        """Выводит count байт файла блоками, при -n нумерует строки"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        line_num = 1
+        at_line_start = True
+
+        while count > 0:
+            chunk = file.read(min(CAT_CHUNK_SIZE, count))
+            if not chunk:
+                break
+            count -= len(chunk)
+            text = decoder.decode(chunk, final=count <= 0)
+
+            if not number_lines:
+                output.write(text)
+                continue
+
+            lines = text.split("\n")
+            for i, line in enumerate(lines):
+                last = i == len(lines) - 1
+                if last and not line:
+                    break
+                if at_line_start:
+                    output.write(f"{line_num:6d}\t")
+                    line_num += 1
+                output.write(line if last else line + "\n")
+                at_line_start = not last
 
     @log
     def cp(self, args: list[str]) -> None:
         """Копирует файл или директорию"""
-        if len(args) < 2 or len(args) > 3:
-            raise Exception("cp requires source and destination arguments")
-
         recursive = False
-        source = None
-        destination = None
+        verbose = False
+        paths = []
 
         # парсим аргументы
         for arg in args:
             if arg == "-r":
                 recursive = True
-            elif source is None:
-                source = arg
+            elif arg == "-v":
+                verbose = True
             else:
-                destination = arg
+                paths.append(arg)
 
-        if not source or not destination:
+        if len(paths) != 2:
             raise Exception("cp requires source and destination arguments")
 
         # раскрываем тильду в путях
-        source = os.path.expanduser(source)
-        destination = os.path.expanduser(destination)
+        source = os.path.expanduser(paths[0])
+        destination = os.path.expanduser(paths[1])
 
         # проверяем существование источника
         if not os.path.exists(source):
@@ -173,8 +323,19 @@ class Terminal:
 
             elif os.path.isdir(source):
                 if recursive:
-                    # для директорий используем copytree
-                    shutil.copytree(source, destination)
+                    from src.copier import TreeCopier
+
+                    # файлы директории копируются параллельно пулом потоков
+                    copier = TreeCopier(
+                        progress=partial(progress_line, "Copied") if verbose else None
+                    )
+                    elapsed = copier.copy_tree(source, destination)
+                    if verbose:
+                        output.line(
+                            progress_summary(
+                                "Copied", copier.files, copier.bytes, elapsed
+                            )
+                        )
                 else:
                     raise Exception(f"Is a directory (use -r for recursive): {source}")
             else:
@@ -214,8 +375,8 @@ class Terminal:
             raise Exception(f"Cannot move {source} to {destination}: {str(e)}")
 
     @log
-    def rm(self, args: list[str]) -> None:
-        """Удаляет файлы и директории"""
+    def rm(self, args: list[str], backup_info: list[dict] | None = None) -> None:
+        """Удаляет файлы и директории, для которых есть место в корзине - переносит"""
         if len(args) == 0:
             raise Exception("rm requires at least one argument")
 
@@ -232,10 +393,16 @@ class Terminal:
         if not targets:
             raise Exception("rm requires at least one target")
 
+        # исходный путь -> место в корзине, которое для него выбрал create_backup
+        reserved = {
+            info["original_path"]: info["trash_path"] for info in backup_info or []
+        }
         for target in targets:
-            self.remove_target(target, recursive)
+            self.remove_target(target, recursive, reserved)
 
-    def remove_target(self, target: str, recursive: bool) -> None:
+    def remove_target(
+        self, target: str, recursive: bool, reserved: dict[str, str] | None = None
+    ) -> None:
         """Удаляет файлы и директории"""
         # проверяем существование
         if not os.path.exists(target):
@@ -249,7 +416,8 @@ class Terminal:
         if os.path.isfile(target):
             # удаление файла
             try:
-                os.remove(target)
+                if not self.move_to_trash(target, reserved):
+                    os.remove(target)
             except Exception as e:
                 raise Exception(f"Cannot remove '{target}': {str(e)}")
 
@@ -264,9 +432,49 @@ class Terminal:
                 return
 
             try:
-                shutil.rmtree(target)
+                if not self.move_to_trash(target, reserved):
+                    shutil.rmtree(target)
             except Exception as e:
                 raise Exception(f"Cannot remove directory '{target}': {str(e)}")
 
         else:
             raise Exception(f"Unknown file type: {target}")
+
+    def move_to_trash(self, target: str, reserved: dict[str, str] | None) -> bool:
+        """Переносит цель в корзину, если для нее сделана резервная копия"""
+        trash_path = reserved.pop(os.path.abspath(target), None) if reserved else None
+        if trash_path is None:
+            return False
+        trash.move(target, trash_path)
+        return True
+
+    @log
+    def stats(self, args: list[str]) -> None:
+        """Выводит время выполнения команд: stats [--json | --prometheus]"""
+        if args == ["--json"]:
+            output.line(command_stats.to_json())
+            return
+        if args == ["--prometheus"]:
+            output.write(command_stats.to_prometheus())
+            return
+        if args:
+            raise Exception("Usage: stats [--json | --prometheus]")
+
+        snapshot = command_stats.snapshot()
+        if not snapshot:
+            output.line("No commands measured")
+            return
+
+        output.line(
+            f"{'command':<14}{'count':>7}{'errors':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'cpu ms':>10}{'~read':>10}{'~write':>10}"
+        )
+        for command, item in snapshot.items():
+            wall = item["wall_seconds"]
+            output.line(
+                f"{command:<14}{item['count']:>7}{item['errors']:>7}"
+                f"{wall['p50'] * 1000:>10.2f}{wall['p95'] * 1000:>10.2f}"
+                f"{wall['p99'] * 1000:>10.2f}{item['cpu_seconds'] * 1000:>10.2f}"
+                f"{format_size(item['read_bytes']):>10}"
+                f"{format_size(item['write_bytes']):>10}"
+            )
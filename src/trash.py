@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from src.filelock import file_lock
+
+# сколько места может занимать корзина
+TRASH_MAX_BYTES = 512 * 1024 * 1024
+
+# сколько хранятся удаленные файлы, секунды
+TRASH_MAX_AGE = 30 * 24 * 3600
+
+# файл с описанием содержимого корзины
+INDEX_NAME = "index.json"
+
+
+def file_hash(path: str) -> str:
+    """sha256 содержимого файла"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def move(source: str, destination: str) -> None:
+    """Переименование в пределах файловой системы, иначе копирование"""
+    try:
+        os.rename(source, destination)
+    except OSError:
+        shutil.move(source, destination)
+
+
+def tree_size(path: str) -> int:
+    """Суммарный размер файлов директории"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path: str) -> None:
+    """Удаляет файл или директорию"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class Trash:
+    """Корзина: одинаковое содержимое файлов хранится один раз
+
+    rm переносит цель в incoming/ переименованием, затем store() кладет ее
+    в blobs/ и записывает в индекс исходный путь и время удаления. Хеш файла
+    считается, только если в корзине уже есть файл того же размера.
+    """
+
+    def __init__(
+        self,
+        trash_dir: str,
+        max_bytes: int = TRASH_MAX_BYTES,
+        max_age: float = TRASH_MAX_AGE,
+    ) -> None:
+        """Основная директория корзины и ограничения на ее размер"""
+        self.trash_dir = trash_dir
+        self.index_path = os.path.join(trash_dir, INDEX_NAME)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # корзины других файловых систем по номеру устройства
+        self._device_dirs: dict[int, str] = {}
+
+    def reserve(self, path: str) -> str:
+        """Выбирает место в корзине для пути, который сейчас удалит rm"""
+        path = os.path.abspath(path)
+        incoming = os.path.join(self.dir_for(path), "incoming")
+        os.makedirs(incoming, exist_ok=True)
+
+        # уникальное имя вместо перебора занятых
+        return os.path.join(incoming, os.urandom(16).hex())
+
+    def store(self, trash_path: str, original_path: str) -> str:
+        """Переносит удаленный объект в хранилище, возвращает номер записи"""
+        with self.transaction() as index:
+            return self._store(index, trash_path, original_path)
+
+    def _store(self, index: dict, trash_path: str, original_path: str) -> str:
+        """store() под блокировкой индекса"""
+        root = os.path.dirname(os.path.dirname(trash_path))
+        entry_id = os.path.basename(trash_path)
+        info = os.lstat(trash_path)
+
+        now = time.time()
+        is_file = stat.S_ISREG(info.st_mode)
+        blob = (
+            self.find_duplicate(index, trash_path, info.st_size, root)
+            if is_file
+            else None
+        )
+        if blob is not None:
+            # такое содержимое уже лежит в корзине
+            os.remove(trash_path)
+            record = index["blobs"][blob]
+            record["refs"] += 1
+            record["used"] = now
+        else:
+            blob = os.path.join(root, "blobs", entry_id)
+            # директории и ссылки хранятся как есть, без хеша
+            size = info.st_size if is_file else tree_size(trash_path)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(trash_path, blob)
+            record = {"size": size, "refs": 1, "used": now}
+            if is_file:
+                # хеш посчитаем, когда появится файл того же размера
+                record["hash"] = None
+            index["blobs"][blob] = record
+
+        index["entries"][entry_id] = {
+            "original": original_path,
+            "blob": blob,
+            "deleted": now,
+            "mode": info.st_mode,
+            "mtime_ns": info.st_mtime_ns,
+        }
+        self.evict(index)
+        return entry_id
+
+    def find_duplicate(
+        self, index: dict, path: str, size: int, root: str
+    ) -> str | None:
+        """Файл в корзине root с тем же содержимым, что у path"""
+        blobs = index["blobs"]
+        blobs_dir = os.path.join(root, "blobs")
+        candidates = [
+            blob
+            for blob, record in blobs.items()
+            if "hash" in record
+            and record["size"] == size
+            and os.path.dirname(blob) == blobs_dir
+            and os.path.lexists(blob)
+        ]
+        if not candidates:
+            return None
+
+        digest = file_hash(path)
+        for blob in candidates:
+            record = blobs[blob]
+            if record["hash"] is None:
+                record["hash"] = file_hash(blob)
+            if record["hash"] == digest:
+                return blob
+        return None
+
+    def restore(self, entry_id: str, original_path: str) -> None:
+        """Возвращает объект из корзины на прежнее место"""
+        with self.transaction() as index:
+            self._restore(index, entry_id, original_path)
+
+    def _restore(self, index: dict, entry_id: str, original_path: str) -> None:
+        """restore() под блокировкой индекса"""
+        entry = index["entries"].get(entry_id)
+        if entry is None or not os.path.lexists(entry["blob"]):
+            raise Exception(f"Backup of '{original_path}' is no longer in trash")
+
+        blob = entry["blob"]
+        record = index["blobs"][blob]
+        os.makedirs(os.path.dirname(original_path), exist_ok=True)
+
+        if record["refs"] > 1:
+            # содержимое нужно другим записям - возвращаем копию
+            shutil.copyfile(blob, original_path)
+            os.chmod(original_path, entry["mode"] & 0o7777)
+            os.utime(original_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            record["refs"] -= 1
+        else:
+            move(blob, original_path)
+            del index["blobs"][blob]
+            if os.path.isfile(original_path) and not os.path.islink(original_path):
+                os.chmod(original_path, entry["mode"] & 0o7777)
+                os.utime(original_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+        del index["entries"][entry_id]
+
+    def discard(self, entry_id: str) -> None:
+        """Удаляет запись, которую уже нельзя будет отменить"""
+        with self.transaction() as index:
+            entry = index["entries"].pop(entry_id, None)
+            if entry is None:
+                return
+
+            blob = entry["blob"]
+            record = index["blobs"].get(blob)
+            if record is not None:
+                record["refs"] -= 1
+                if record["refs"] <= 0:
+                    del index["blobs"][blob]
+                    remove_path(blob)
+
+    def evict(self, index: dict) -> int:
+        """Удаляет давние объекты и самые старые сверх лимита размера"""
+        blobs = index["blobs"]
+        total = sum(record["size"] for record in blobs.values())
+        now = time.time()
+
+        # самый свежий объект оставляем, даже если он один больше лимита
+        order = sorted(blobs, key=lambda blob: blobs[blob]["used"])[:-1]
+        removed = 0
+        for blob in order:
+            record = blobs[blob]
+            if total <= self.max_bytes and now - record["used"] <= self.max_age:
+                break
+            self.drop(index, blob)
+            total -= record["size"]
+            removed += 1
+        return removed
+
+    def drop(self, index: dict, blob: str) -> None:
+        """Удаляет объект и все записи, которые на него ссылаются"""
+        del index["blobs"][blob]
+        for entry_id, entry in list(index["entries"].items()):
+            if entry["blob"] == blob:
+                del index["entries"][entry_id]
+        remove_path(blob)
+
+    def usage(self) -> int:
+        """Сколько байт занимает корзина"""
+        return sum(record["size"] for record in self.load()["blobs"].values())
+
+    def load(self) -> dict:
+        """Читает индекс корзины"""
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"entries": {}, "blobs": {}}
+
+    def save(self, index: dict) -> None:
+        """Атомарно записывает индекс корзины"""
+        os.makedirs(self.trash_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @contextmanager
+    def transaction(self) -> Iterator[dict]:
+        """Индекс под блокировкой: перечитывается и сохраняется, если не было ошибки
+
+        Корзину делят все оболочки, поэтому индекс не кешируется: иначе
+        оболочка затерла бы чужие записи своей старой копией.
+        """
+        with file_lock(self.index_path):
+            index = self.load()
+            yield index
+            self.save(index)
+
+    def dir_for(self, path: str) -> str:
+        """Корзина на той же файловой системе, что и path"""
+        os.makedirs(self.trash_dir, exist_ok=True)
+        device = os.lstat(path).st_dev
+        if device == os.stat(self.trash_dir).st_dev:
+            return self.trash_dir
+
+        if device not in self._device_dirs:
+            uid = os.getuid() if hasattr(os, "getuid") else 0
+            device_dir = os.path.join(self.mount_point(path, device), f".Trash-{uid}")
+            try:
+                os.makedirs(device_dir, exist_ok=True)
+            except OSError:
+                # в корень чужой файловой системы писать нельзя - будем копировать
+                device_dir = self.trash_dir
+            self._device_dirs[device] = device_dir
+
+        return self._device_dirs[device]
+
+    def mount_point(self, path: str, device: int) -> str:
+        """Верхняя директория файловой системы, на которой лежит path"""
+        current = os.path.dirname(path)
+        while True:
+            parent = os.path.dirname(current)
+            if parent == current or os.lstat(parent).st_dev != device:
+                return current
+            current = parent
@@ -0,0 +1,379 @@
+import json
+import os
+from array import array
+
+# имя файла индекса в корне проиндексированной директории
+INDEX_NAME = ".grepindex"
+
+INDEX_MAGIC = b"TRGM1\n"
+
+# большие файлы не индексируем, grep всегда читает их целиком
+INDEX_MAX_FILESIZE = 16 * 1024 * 1024
+
+# сколько байт в начале файла проверяем на нулевые байты
+BINARY_SNIFF_SIZE = 32 * 1024
+
+
+def file_trigrams(data: bytes) -> set[int]:
+    """Множество триграмм содержимого, ASCII приводится к нижнему регистру"""
+    data = data.lower()
+    grams = {data[i : i + 3] for i in range(len(data) - 2)}
+    return {int.from_bytes(gram, "big") for gram in grams}
+
+
+def skip_escape(pattern: str, i: int) -> int:
+    """Позиция после escape-последовательности, начинающейся в i"""
+    escaped = pattern[i + 1 : i + 2]
+    i += 2
+    if escaped in ("x", "u", "U"):
+        # \xhh, \uhhhh, \Uhhhhhhhh
+        i += {"x": 2, "u": 4, "U": 8}[escaped]
+    elif escaped == "N" and pattern[i : i + 1] == "{":
+        end = pattern.find("}", i)
+        i = len(pattern) if end == -1 else end + 1
+    elif escaped.isdigit():
+        # восьмеричный код \0, \101 или обратная ссылка \12
+        end = i
+        while end < len(pattern) and end - i < 2 and pattern[end].isdigit():
+            end += 1
+        i = end
+    return min(i, len(pattern))
+
+
+def literal_runs(pattern: str) -> list[str] | None:
+    """Подстроки, которые обязаны входить в любое совпадение шаблона
+
+    Возвращает None, если шаблон нельзя разобрать без полного поиска
+    (альтернативы верхнего уровня, флаги и просмотр вокруг).
+    """
+    runs: list[str] = []
+    run = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            if escaped and not escaped.isalnum():
+                run += escaped
+                i += 2
+            else:
+                # классы символов, коды символов и ссылки вида \d, \x41, \1
+                # рвут подстроку, escape пропускаем целиком
+                runs.append(run)
+                run = ""
+                i = skip_escape(pattern, i)
+        elif char in "*?{":
+            # предыдущий символ необязателен
+            runs.append(run[:-1])
+            run = ""
+            if char == "{":
+                end = pattern.find("}", i)
+                i = len(pattern) if end == -1 else end
+            i += 1
+            if pattern[i : i + 1] in ("?", "+"):
+                i += 1
+        elif char == "+":
+            # символ повторяется: подстрока обрывается, но он сам остается
+            runs.append(run)
+            run = run[-1:]
+            i += 1
+            if pattern[i : i + 1] in ("?", "+"):
+                i += 1
+        elif char == "[":
+            runs.append(run)
+            run = ""
+            i = skip_class(pattern, i)
+        elif char == "(":
+            if pattern[i + 1 : i + 2] == "?" and pattern[i + 2 : i + 3] != ":":
+                return None
+            runs.append(run)
+            run = ""
+            i = skip_group(pattern, i)
+            if i < 0:
+                return None
+        elif char in "|)":
+            return None
+        elif char in ".^$":
+            runs.append(run)
+            run = ""
+            i += 1
+        else:
+            run += char
+            i += 1
+
+    runs.append(run)
+    return [run for run in runs if run]
+
+
+def skip_class(pattern: str, i: int) -> int:
+    """Позиция после класса символов [...]"""
+    i += 1
+    if pattern[i : i + 1] == "^":
+        i += 1
+    if pattern[i : i + 1] == "]":
+        i += 1
+    while i < len(pattern) and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+    return i + 1
+
+
+def skip_group(pattern: str, i: int) -> int:
+    """Позиция после группы (...), -1 если скобки не закрыты"""
+    depth = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            i += 2
+            continue
+        if char == "[":
+            i = skip_class(pattern, i)
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
+
+
+def pattern_trigrams(pattern: str, ignore_case: bool) -> set[int] | None:
+    """Триграммы, которые должны быть в файле с совпадением
+
+    None или пустое множество означает, что нужен полный поиск.
+    """
+    runs = literal_runs(pattern)
+    if runs is None:
+        return None
+
+    pieces: list[bytes] = []
+    for run in runs:
+        if ignore_case:
+            # регистр не-ASCII символов индекс не учитывает
+            pieces.extend(part.encode("ascii") for part in split_non_ascii(run))
+        else:
+            pieces.append(run.encode("utf-8"))
+
+    trigrams: set[int] = set()
+    for piece in pieces:
+        trigrams |= file_trigrams(piece)
+    return trigrams
+
+
+def split_non_ascii(text: str) -> list[str]:
+    """Разбивает строку на ASCII-участки"""
+    parts = []
+    current = ""
+    for char in text:
+        if char.isascii():
+            current += char
+        else:
+            parts.append(current)
+            current = ""
+    parts.append(current)
+    return parts
+
+
+class TrigramIndex:
+    """Индекс триграмм для быстрого отбора файлов перед grep"""
+
+    def __init__(self, root: str) -> None:
+        """Пустой индекс для директории root"""
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, INDEX_NAME)
+        # файлы по номерам, None - удаленный файл
+        self.files: list[list | None] = []
+        self.ids: dict[str, int] = {}
+        self.postings: dict[int, array] = {}
+
+    @classmethod
+    def find(cls, directory: str) -> "TrigramIndex | None":
+        """Ищет индекс в директории и ее родителях"""
+        current = os.path.abspath(directory)
+        while True:
+            if os.path.isfile(os.path.join(current, INDEX_NAME)):
+                return cls.load(current)
+            parent = os.path.dirname(current)
+            if parent == current:
+                return None
+            current = parent
+
+    @classmethod
+    def load(cls, root: str) -> "TrigramIndex | None":
+        """Загружает индекс с диска"""
+        index = cls(root)
+        try:
+            with open(index.path, "rb") as f:
+                if f.readline() != INDEX_MAGIC:
+                    return None
+                header = json.loads(f.readline())
+                flat = array("I")
+                flat.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+
+        index.files = header["files"]
+        index.ids = {item[0]: i for i, item in enumerate(index.files) if item}
+
+        i = 0
+        while i < len(flat):
+            trigram, count = flat[i], flat[i + 1]
+            index.postings[trigram] = flat[i + 2 : i + 2 + count]
+            i += 2 + count
+        return index
+
+    def save(self) -> None:
+        """Атомарно записывает индекс на диск"""
+        flat = array("I")
+        for trigram, ids in self.postings.items():
+            flat.append(trigram)
+            flat.append(len(ids))
+            flat.extend(ids)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(json.dumps({"files": self.files}).encode("utf-8") + b"\n")
+            f.write(flat.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def update(self) -> tuple[int, int, int]:
+        """Переиндексирует новые и измененные файлы по mtime и размеру"""
+        added = updated = 0
+        seen = set()
+
+        for path, _, files in os.walk(self.root):
+            for file in files:
+                file_path = os.path.join(path, file)
+                rel = os.path.relpath(file_path, self.root)
+                if rel == INDEX_NAME or rel == INDEX_NAME + ".tmp":
+                    continue
+                try:
+                    info = os.stat(file_path)
+                except OSError:
+                    continue
+                seen.add(rel)
+
+                old_id = self.ids.get(rel)
+                if old_id is not None and self.is_fresh(old_id, info):
+                    continue
+                if info.st_size > INDEX_MAX_FILESIZE:
+                    # без записи в индексе файл всегда проверяется полностью
+                    if old_id is not None:
+                        self.forget(rel)
+                    continue
+
+                if self.add(rel, file_path, info):
+                    if old_id is None:
+                        added += 1
+                    else:
+                        updated += 1
+
+        removed = 0
+        for rel in list(self.ids):
+            if rel not in seen:
+                self.forget(rel)
+                removed += 1
+
+        # когда удаленных записей больше живых, пересобираем списки
+        live = len(self.ids)
+        if len(self.files) - live > live:
+            self.compact()
+
+        return added, updated, removed
+
+    def add(self, rel: str, file_path: str, info: os.stat_result) -> bool:
+        """Добавляет файл в индекс"""
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        if rel in self.ids:
+            self.forget(rel)
+
+        file_id = len(self.files)
+        self.files.append([rel, info.st_mtime_ns, info.st_size])
+        self.ids[rel] = file_id
+
+        # у двоичных файлов триграмм нет: grep их все равно пропускает
+        if data.find(b"\0", 0, BINARY_SNIFF_SIZE) == -1:
+            for trigram in file_trigrams(data):
+                self.postings.setdefault(trigram, array("I")).append(file_id)
+        return True
+
+    def forget(self, rel: str) -> None:
+        """Помечает файл удаленным"""
+        file_id = self.ids.pop(rel)
+        self.files[file_id] = None
+
+    def compact(self) -> None:
+        """Перенумеровывает файлы и выкидывает удаленные из списков"""
+        remap: dict[int, int] = {}
+        files: list[list] = []
+        for old_id, item in enumerate(self.files):
+            if item is not None:
+                remap[old_id] = len(files)
+                files.append(item)
+
+        postings = {}
+        for trigram, ids in self.postings.items():
+            alive = array("I", (remap[i] for i in ids if i in remap))
+            if alive:
+                postings[trigram] = alive
+
+        self.files = list(files)
+        self.ids = {item[0]: i for i, item in enumerate(files)}
+        self.postings = postings
+
+    def is_fresh(self, file_id: int, info: os.stat_result) -> bool:
+        """Совпадает ли файл на диске с проиндексированным"""
+        item = self.files[file_id]
+        return (
+            item is not None and item[1] == info.st_mtime_ns and item[2] == info.st_size
+        )
+
+    def candidates(self, trigrams: set[int]) -> set[int]:
+        """Номера файлов, содержащих все триграммы"""
+        lists = []
+        for trigram in trigrams:
+            ids = self.postings.get(trigram)
+            if ids is None:
+                return set()
+            lists.append(ids)
+
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return result
+
+    def can_skip(self, file_path: str, candidates: set[int]) -> bool:
+        """Файл проиндексирован, не менялся и точно не содержит шаблон"""
+        rel = os.path.relpath(os.path.abspath(file_path), self.root)
+        file_id = self.ids.get(rel)
+        if file_id is None or file_id in candidates:
+            return False
+        try:
+            return self.is_fresh(file_id, os.stat(file_path))
+        except OSError:
+            return False
+
+    def stats(self) -> dict:
+        """Сводка по индексу"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {
+            "root": self.root,
+            "files": len(self.ids),
+            "trigrams": len(self.postings),
+            "postings": sum(len(ids) for ids in self.postings.values()),
+            "size": size,
+        }
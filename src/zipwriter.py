@@ -0,0 +1,369 @@
+import os
+import stat
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from src.gzipwriter import COMPRESS_WORKERS
+
+# размер блока, который сжимается отдельно
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# предыдущие данные, которые видит сжатие следующего блока
+DEFLATE_WINDOW = 32 * 1024
+
+# с этого размера поля заголовков не помещаются в 4 байта
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+STORED = 0
+DEFLATED = 8
+
+# размеры и crc сжатых записей идут после данных, имя в utf-8
+FLAG_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+# уже сжатые форматы, которые бесполезно сжимать повторно
+STORED_SUFFIXES = frozenset(
+    {
+        ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".zip", ".7z", ".rar",
+        ".jar", ".whl", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+        ".mp3", ".ogg", ".flac", ".mp4", ".mkv", ".avi", ".mov", ".webm",
+        ".docx", ".xlsx", ".pptx", ".woff", ".woff2",
+    }
+)  # fmt: skip
+
+
+def compress_chunk(data: bytes, level: int, last: bool, zdict: bytes) -> bytes:
+    """Сжимает блок отдельным потоком deflate, блоки можно склеивать подряд"""
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data)
+    # Z_SYNC_FLUSH выравнивает поток по байту, не завершая его
+    return compressed + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def dos_datetime(mtime: float) -> tuple[int, int]:
+    """Дата и время в формате MS-DOS, как их хранит zip"""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    clock = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return date, clock
+
+
+@dataclass
+class ZipEntry:
+    """Запись архива"""
+
+    name: str
+    mode: int
+    mtime: float
+    method: int
+    zip64: bool = False
+    offset: int = 0
+    crc: int = 0
+    file_size: int = 0
+    compress_size: int = 0
+
+    @property
+    def is_dir(self) -> bool:
+        """Запись о директории"""
+        return self.name.endswith("/")
+
+    @property
+    def flags(self) -> int:
+        """Флаги записи"""
+        # crc и размеры несжатых записей известны до заголовка
+        flags = FLAG_DESCRIPTOR if self.method == DEFLATED else 0
+        if not self.name.isascii():
+            flags |= FLAG_UTF8
+        return flags
+
+    @property
+    def version(self) -> int:
+        """Версия формата, нужная для распаковки"""
+        return 45 if self.zip64 else 20
+
+
+class ZipWriter:
+    """Потоковая запись zip: блоки файлов сжимаются параллельно
+
+    Архив пишется строго последовательно, без перемоток, поэтому crc и
+    размеры сжатой записи идут в дескрипторе после ее данных. Несжатые
+    файлы читаются дважды: crc нужен в локальном заголовке.
+    """
+
+    def __init__(
+        self, path: str, level: int = 6, workers: int = COMPRESS_WORKERS
+    ) -> None:
+        """Путь архива, степень сжатия 0-9 и число потоков"""
+        if not 0 <= level <= 9:
+            raise Exception("Compression level must be between 0 and 9")
+        self.path = path
+        self.level = level
+        self.workers = workers
+        self.entries: list[ZipEntry] = []
+        self._offset = 0
+        self._out: BinaryIO | None = None
+
+    def write_tree(self, root: str) -> int:
+        """Записывает содержимое директории root, возвращает число записей"""
+        # части архива в порядке записи: заголовок, блоки данных, дескриптор
+        parts: deque[tuple] = deque()
+        in_flight = 0
+
+        with open(self.path, "wb") as out, ThreadPoolExecutor(self.workers) as pool:
+            self._out = out
+            for name, path, info in self.walk(root):
+                entry = self.make_entry(name, path, info)
+                parts.append(("start", entry))
+
+                if not entry.is_dir:
+                    for chunk in self.read_chunks(entry, path, pool):
+                        parts.append(("data", entry, chunk))
+                        in_flight += 1
+                        # ограничиваем число блоков в памяти
+                        while in_flight > self.workers * 4:
+                            in_flight -= self.write_part(parts.popleft())
+
+                parts.append(("end", entry))
+
+            while parts:
+                self.write_part(parts.popleft())
+            self.write_central_directory()
+
+        return len(self.entries)
+
+    def walk(self, root: str):
+        """Перебирает директории и файлы дерева в стабильном порядке"""
+        archive = os.path.realpath(self.path)
+        for path, dirs, files in os.walk(root):
+            dirs.sort()
+            rel = os.path.relpath(path, root)
+            prefix = "" if rel == "." else rel.replace(os.sep, "/") + "/"
+            if prefix:
+                yield prefix, path, os.stat(path)
+
+            for file in sorted(files):
+                file_path = os.path.join(path, file)
+                # архив внутри упаковываемой директории не упаковываем
+                if os.path.realpath(file_path) == archive:
+                    continue
+                yield prefix + file, file_path, os.stat(file_path)
+
+    def make_entry(self, name: str, path: str, info: os.stat_result) -> ZipEntry:
+        """Запись для файла или директории"""
+        suffix = os.path.splitext(name)[1].lower()
+        stored = (
+            stat.S_ISDIR(info.st_mode)
+            or self.level == 0
+            or info.st_size == 0
+            or suffix in STORED_SUFFIXES
+        )
+        return ZipEntry(
+            name=name,
+            mode=info.st_mode,
+            mtime=info.st_mtime,
+            method=STORED if stored else DEFLATED,
+            # несжимаемые данные deflate немного раздувает
+            zip64=info.st_size * 1.05 >= ZIP64_LIMIT,
+        )
+
+    def read_chunks(self, entry: ZipEntry, path: str, pool: ThreadPoolExecutor):
+        """Читает файл блоками, блоки для сжатия отдает пулу"""
+        if entry.method == STORED:
+            yield from self.read_stored(entry, path)
+            return
+
+        with open(path, "rb") as f:
+            data = f.read(ZIP_CHUNK_SIZE)
+            previous = b""
+            while True:
+                following = f.read(ZIP_CHUNK_SIZE) if data else b""
+                entry.crc = zlib.crc32(data, entry.crc)
+                entry.file_size += len(data)
+
+                last = not following
+                yield pool.submit(compress_chunk, data, self.level, last, previous)
+                previous = data[-DEFLATE_WINDOW:]
+
+                if not following:
+                    return
+                data = following
+
+    def read_stored(self, entry: ZipEntry, path: str):
+        """Читает файл без сжатия, crc и размер считаются до первого блока"""
+        with open(path, "rb") as f:
+            while data := f.read(ZIP_CHUNK_SIZE):
+                entry.crc = zlib.crc32(data, entry.crc)
+                entry.file_size += len(data)
+
+            f.seek(0)
+            crc = size = 0
+            while data := f.read(ZIP_CHUNK_SIZE):
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                yield data
+
+        if crc != entry.crc or size != entry.file_size:
+            raise Exception(f"File changed while archiving: {path}")
+
+    def write_part(self, part: tuple) -> int:
+        """Записывает часть архива, возвращает 1 для блока данных"""
+        kind, entry = part[0], part[1]
+        if kind == "start":
+            entry.offset = self._offset
+            self.write_local_header(entry)
+            return 0
+
+        if kind == "data":
+            chunk = part[2]
+            data = chunk.result() if isinstance(chunk, Future) else chunk
+            self.write(data)
+            entry.compress_size += len(data)
+            return 1
+
+        # дескриптор с crc и размерами после данных
+        if entry.flags & FLAG_DESCRIPTOR:
+            size_format = "<IIQQ" if entry.zip64 else "<IIII"
+            self.write(
+                struct.pack(
+                    size_format,
+                    0x08074B50,
+                    entry.crc,
+                    entry.compress_size,
+                    entry.file_size,
+                )
+            )
+        self.entries.append(entry)
+        return 0
+
+    def write_local_header(self, entry: ZipEntry) -> None:
+        """Локальный заголовок записи"""
+        name = entry.name.encode("utf-8")
+        # без дескриптора crc и размеры пишутся сразу, у несжатой записи
+        # сжатый размер равен исходному
+        known = not entry.flags & FLAG_DESCRIPTOR
+        crc = entry.crc if known else 0
+        size = entry.file_size if known else 0
+        extra = struct.pack("<HHQQ", 1, 16, size, size) if entry.zip64 else b""
+        if entry.zip64:
+            size = ZIP64_LIMIT
+        date, clock = dos_datetime(entry.mtime)
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            entry.version,
+            entry.flags,
+            entry.method,
+            clock,
+            date,
+            crc,
+            size,
+            size,
+            len(name),
+            len(extra),
+        )
+        self.write(header + name + extra)
+
+    def write_central_directory(self) -> None:
+        """Центральный каталог и конец архива"""
+        start = self._offset
+        for entry in self.entries:
+            file_size, compress_size, offset = (
+                entry.file_size,
+                entry.compress_size,
+                entry.offset,
+            )
+            # значения, не влезающие в 4 байта, уходят в поле zip64
+            fields = []
+            if entry.zip64 or file_size >= ZIP64_LIMIT:
+                fields.append(file_size)
+                file_size = ZIP64_LIMIT
+            if entry.zip64 or compress_size >= ZIP64_LIMIT:
+                fields.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra = b""
+            if fields:
+                extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields)
+
+            version = 45 if fields else entry.version
+            external = (entry.mode & 0xFFFF) << 16
+            if entry.is_dir:
+                external |= 0x10
+            name = entry.name.encode("utf-8")
+            date, clock = dos_datetime(entry.mtime)
+            header = struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                (3 << 8) | version,
+                version,
+                entry.flags,
+                entry.method,
+                clock,
+                date,
+                entry.crc,
+                compress_size,
+                file_size,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                external,
+                offset,
+            )
+            self.write(header + name + extra)
+
+        count = len(self.entries)
+        size = self._offset - start
+        if count >= ZIP_MAX_ENTRIES or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            end64 = self._offset
+            self.write(
+                struct.pack(
+                    "<IQHHIIQQQQ",
+                    0x06064B50,
+                    44,
+                    45,
+                    45,
+                    0,
+                    0,
+                    count,
+                    count,
+                    size,
+                    start,
+                )
+            )
+            self.write(struct.pack("<IIQI", 0x07064B50, 0, end64, 1))
+
+        self.write(
+            struct.pack(
+                "<IHHHHIIH",
+                0x06054B50,
+                0,
+                0,
+                min(count, ZIP_MAX_ENTRIES),
+                min(count, ZIP_MAX_ENTRIES),
+                min(size, ZIP64_LIMIT),
+                min(start, ZIP64_LIMIT),
+                0,
+            )
+        )
+
+    def write(self, data: bytes) -> None:
+        """Дописывает данные в архив"""
+        if self._out is None:
+            raise Exception("Archive is not open for writing")
+        self._out.write(data)
+        self._offset += len(data)
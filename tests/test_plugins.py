@@ -1,13 +1,22 @@
+import gzip
 import os
+import struct
+import tarfile
+import zipfile
+import zlib
 
 import pytest
 from pyfakefs.fake_filesystem import FakeFilesystem
 from pytest import CaptureFixture, MonkeyPatch
 
+from src.gzipwriter import ParallelGzipWriter
+from src.journal import HistoryJournal, UndoJournal
 from src.plugins.archive import ArchivePlugin
 from src.plugins.history import HistoryPlugin
-from src.plugins.search import SearchPlugin
+from src.plugins.search import SearchPlugin, read_blocks
 from src.terminal import Terminal
+from src.trash import Trash
+from src.trigram import TrigramIndex, literal_runs
 
 
 class TestArchivePlugin:
@@ -25,6 +34,184 @@ class TestArchivePlugin:
         with pytest.raises(Exception, match="Usage: zip <folder> <archive>"):
             archive.zip(["documents", "archive.zip", "abc"])
 
+    def test_zip_streaming(
+        self, archive: ArchivePlugin, fake_fs: FakeFilesystem, monkeypatch: MonkeyPatch
+    ) -> None:
+        """Тест zip: блоки сжимаются отдельно, сжатые форматы не пережимаются"""
+        monkeypatch.setattr("src.zipwriter.ZIP_CHUNK_SIZE", 1000)
+        text = b"".join(b"line %d\n" % i for i in range(2000))
+        fake_fs.create_file("/home/user/data/big.txt", contents=text)
+        fake_fs.create_file("/home/user/data/sub/packed.gz", contents=os.urandom(3000))
+
+        archive.zip(["data", "data", "-9"])
+        with zipfile.ZipFile("/home/user/data.zip") as zf:
+            assert zf.testzip() is None
+            assert zf.read("big.txt") == text
+            assert zf.getinfo("big.txt").compress_type == zipfile.ZIP_DEFLATED
+            assert zf.getinfo("sub/packed.gz").compress_type == zipfile.ZIP_STORED
+            assert zf.namelist() == ["big.txt", "sub/", "sub/packed.gz"]
+            # дескриптор после данных только у сжатых записей
+            packed = zf.getinfo("sub/packed.gz")
+            assert not packed.flag_bits & 0x08
+            assert zf.getinfo("big.txt").flag_bits & 0x08
+        with open("/home/user/data.zip", "rb") as f:
+            f.seek(packed.header_offset + 14)
+            assert f.read(12) == struct.pack("<III", packed.CRC, 3000, 3000)
+
+        with pytest.raises(Exception, match="Usage: zip"):
+            archive.zip(["data", "data", "-10"])
+        with pytest.raises(Exception, match="Not a directory: missing"):
+            archive.zip(["missing", "missing"])
+
+    def test_tar_parallel_gzip(
+        self, archive: ArchivePlugin, fake_fs: FakeFilesystem
+    ) -> None:
+        """Тест tar: архив из независимых членов gzip читается целиком"""
+        archive.tar(["documents", "documents/snap", "-1"])
+        with tarfile.open("/home/user/documents/snap.tar.gz") as tar:
+            assert tar.getnames() == [".", "./doc1.txt"]
+        archive.untar(["documents/snap.tar.gz"])
+        assert os.path.exists("/home/user/documents/snap/doc1.txt")
+
+        data = b"".join(b"row %d\n" % i for i in range(5000))
+        with ParallelGzipWriter(
+            "/home/user/blocks.gz", workers=2, block_size=4096
+        ) as gz:
+            for start in range(0, len(data), 1000):
+                gz.write(data[start : start + 1000])
+        with open("/home/user/blocks.gz", "rb") as f:
+            packed = f.read()
+        assert gzip.decompress(packed) == data
+        assert len(gz.blocks) == -(-len(data) // 4096)
+        # каждый блок распаковывается сам по себе
+        offset, data_offset = gz.blocks[3]
+        assert zlib.decompressobj(31).decompress(packed[offset:])[:10] == (
+            data[data_offset : data_offset + 10]
+        )
+
+    def test_extract(
+        self,
+        archive: ArchivePlugin,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        """Тест распаковки: параллельный unzip, потоковый untar, прогресс"""
+        allocated: list[int] = []
+
+        def fake_preallocate(fd: int, size: int) -> None:
+            allocated.append(size)
+
+        monkeypatch.setattr("src.extractor.preallocate", fake_preallocate)
+        fake_fs.create_file("/home/user/documents/sub/run.sh", contents="echo")
+        os.chmod("/home/user/documents/sub/run.sh", 0o755)
+        archive.zip(["documents", "docs"])
+        archive.unzip(["docs", "-v"])
+        assert "Extracted 2 files, 11 B" in capsys.readouterr().out
+        with open("/home/user/docs/sub/run.sh") as f:
+            assert f.read() == "echo"
+        assert os.stat("/home/user/docs/sub/run.sh").st_mode & 0o777 == 0o755
+
+        archive.tar(["documents", "docs"])
+        allocated.clear()
+        archive.untar(["docs.tar.gz"])
+        with open("/home/user/docs/doc1.txt") as f:
+            assert f.read() == "content"
+        assert os.stat("/home/user/docs/sub/run.sh").st_mode & 0o777 == 0o755
+        assert sorted(allocated) == [4, 7]
+
+    def test_extract_unsafe(
+        self, archive: ArchivePlugin, fake_fs: FakeFilesystem
+    ) -> None:
+        """Тест распаковки: пути за пределами директории отклоняются"""
+        with zipfile.ZipFile("/home/user/evil.zip", "w") as zf:
+            zf.writestr("../escaped.txt", "bad")
+        with pytest.raises(Exception, match="Unsafe path in archive: ../escaped.txt"):
+            archive.unzip(["evil.zip"])
+
+        with tarfile.open("/home/user/evil.tar.gz", "w:gz") as tar:
+            link = tarfile.TarInfo("passwd")
+            link.type = tarfile.SYMTYPE
+            link.linkname = "/etc/passwd"
+            tar.addfile(link)
+        with pytest.raises(Exception, match="Unsafe path in archive: passwd"):
+            archive.untar(["evil.tar.gz"])
+        assert not os.path.exists("/home/user/escaped.txt")
+        assert not os.path.lexists("/home/user/evil/passwd")
+
+    def test_tar_incremental(
+        self, archive: ArchivePlugin, fake_fs: FakeFilesystem, capsys: CaptureFixture
+    ) -> None:
+        """Тест tar -g: снимки содержат только изменения, цепочка восстанавливается"""
+        fake_fs.create_file("/home/user/documents/sub/old.txt", contents="old")
+        archive.tar(["documents", "full", "-g", "manifest.json"])
+        assert "(2 changed, 0 deleted)" in capsys.readouterr().out
+
+        with open("/home/user/documents/doc1.txt", "w") as f:
+            f.write("new content")
+        os.remove("/home/user/documents/sub/old.txt")
+        os.rmdir("/home/user/documents/sub")
+        archive.tar(["documents", "inc", "-g", "manifest.json"])
+        assert "(1 changed, 2 deleted)" in capsys.readouterr().out
+        with tarfile.open("/home/user/inc.tar.gz") as tar:
+            assert tar.getnames() == ["./.snapshot.json", ".", "./doc1.txt"]
+
+        archive.untar(["inc", "-g", "manifest.json"])
+        assert sorted(os.listdir("/home/user/inc")) == ["doc1.txt"]
+        with open("/home/user/inc/doc1.txt") as f:
+            assert f.read() == "new content"
+        archive.untar(["full", "-g", "manifest.json"])
+        assert os.path.exists("/home/user/full/sub/old.txt")
+        # без -g служебный член снимка не распаковывается
+        archive.untar(["inc"])
+        assert sorted(os.listdir("/home/user/inc")) == ["doc1.txt"]
+
+        with pytest.raises(Exception, match="already in the snapshot chain"):
+            archive.tar(["documents", "inc", "-g", "manifest.json"])
+        with pytest.raises(Exception, match="Usage: tar"):
+            archive.tar(["documents", "inc", "--hash"])
+
+    def test_list_and_extract(
+        self,
+        archive: ArchivePlugin,
+        terminal: Terminal,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture,
+    ) -> None:
+        """Тест ls по архиву и извлечения одного файла"""
+        fake_fs.create_file("/home/user/documents/sub/deep.txt", contents="deep")
+        archive.zip(["documents", "docs"])
+        archive.tar(["documents", "docs"])
+        assert os.path.exists("/home/user/docs.tar.gz.idx")
+        capsys.readouterr()
+
+        for name in ("docs.zip", "docs.tar.gz"):
+            terminal.ls(["-l", name])
+            lines = capsys.readouterr().out.splitlines()
+            assert [line.split()[-1] for line in lines] == [
+                "doc1.txt",
+                "sub",
+                "sub/deep.txt",
+            ]
+            assert lines[1].startswith("d")
+
+            archive.extract([name, "sub/deep.txt", "copy.txt"])
+            with open("/home/user/copy.txt") as f:
+                assert f.read() == "deep"
+            with pytest.raises(Exception, match="No such member in archive: nope"):
+                archive.extract([name, "nope"])
+            capsys.readouterr()
+
+        # без индекса архив сканируется один раз, индекс восстанавливается
+        os.remove("/home/user/docs.tar.gz.idx")
+        terminal.ls(["docs.tar.gz"])
+        assert "sub/deep.txt" in capsys.readouterr().out
+        assert not os.path.exists("/home/user/docs.tar.gz.idx")
+        archive.extract(["docs.tar.gz", "./doc1.txt", "documents"])
+        assert os.path.exists("/home/user/docs.tar.gz.idx")
+        with open("/home/user/documents/doc1.txt") as f:
+            assert f.read() == "content"
+
     def test_unzip_error(self, archive: ArchivePlugin, fake_fs: FakeFilesystem) -> None:
         """Тест ошибок unzip"""
         with pytest.raises(Exception, match="Usage: unzip <archive>"):
@@ -58,12 +245,160 @@ class TestSearchPlugin:
         assert "content" in output
         assert "CONTENT" in output
 
+    def test_grep_parallel(
+        self, search: SearchPlugin, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест grep -j с сохранением порядка обхода"""
+        for i in range(100):
+            fake_fs.create_file(f"/home/user/many/f{i:03}.txt", contents=f"line {i}\n")
+        search.grep(["line", "/home/user/many", "-r"])
+        expected = capsys.readouterr().out
+        search.grep(["line", "/home/user/many", "-r", "-j", "4", "--threads"])
+        output = capsys.readouterr().out
+        assert output == expected
+        assert len(output.splitlines()) == 100
+
+    def test_grep_chunks(
+        self,
+        search: SearchPlugin,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture[str],
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        """Тест поиска блоками с совпадениями на границе блоков"""
+        monkeypatch.setattr("src.plugins.search.CHUNK_SIZE", 16)
+        lines = [f"row {i} {'needle' if i % 3 == 0 else 'hay'}" for i in range(30)]
+        fake_fs.create_file("/home/user/big.txt", contents="\n".join(lines))
+        expected = [
+            f"/home/user/big.txt:{i + 1}: {line}"
+            for i, line in enumerate(lines)
+            if "needle" in line
+        ]
+        search.grep(["needle", "/home/user/big.txt"])
+        assert capsys.readouterr().out.splitlines() == expected
+        search.grep([r"ne+dle$", "/home/user/big.txt"])
+        assert capsys.readouterr().out.splitlines() == expected
+
+        # длинная строка без переводов собирается из нескольких блоков
+        fake_fs.create_file("/home/user/long.txt", contents="x" * 100 + "needle\nend")
+        search.grep(["needle", "/home/user/long.txt"])
+        assert capsys.readouterr().out == f"/home/user/long.txt:1: {'x' * 100}needle\n"
+
+        # двоичный файл без переводов строк бросаем после первого чтения
+        fake_fs.create_file("/home/user/nul.bin", contents=b"\0" + b"needle" * 100)
+        assert list(read_blocks("/home/user/nul.bin")) == []
+
+        # построчная проверка делит строки только по \n
+        fake_fs.create_file("/home/user/ff.txt", contents="a\x0cb\nc\x1cd\nneedle\n")
+        search.grep([r"(?<!x)needle", "/home/user/ff.txt"])
+        assert capsys.readouterr().out == "/home/user/ff.txt:3: needle\n"
+
+    def test_grep_skip(
+        self, search: SearchPlugin, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест пропуска двоичных, больших и исключенных файлов"""
+        fake_fs.create_file("/home/user/image.bin", contents=b"content\0\x01\x02")
+        fake_fs.create_file("/home/user/big.log", contents="content\n" * 1000)
+        fake_fs.create_file("/home/user/.trash/old.txt", contents="content")
+        search.grep(
+            [
+                "content",
+                "/home/user",
+                "-r",
+                "--max-filesize",
+                "1K",
+                "--exclude-dir",
+                ".trash",
+                "--exclude",
+                "test2*",
+            ]
+        )
+        output = capsys.readouterr().out
+        assert "test1.txt" in output
+        assert "doc1.txt" in output
+        assert "test2.txt" not in output
+        assert "image.bin" not in output
+        assert "big.log" not in output
+        assert ".trash" not in output
+
+        search.grep(["content", "/home/user", "-r", "--include", "doc*"])
+        lines = capsys.readouterr().out.splitlines()
+        assert lines == ["/home/user/documents/doc1.txt:1: content"]
+
+    def test_literal_runs(self) -> None:
+        """Тест выделения обязательных подстрок из шаблона"""
+        assert literal_runs("hello") == ["hello"]
+        assert literal_runs(r"foo\.bar\d+baz") == ["foo.bar", "baz"]
+        assert literal_runs("abc?def") == ["ab", "def"]
+        assert literal_runs("ab+cd") == ["ab", "bcd"]
+        assert literal_runs("(x|y)zzz[a-z]end") == ["zzz", "end"]
+        assert literal_runs("foo|bar") is None
+        assert literal_runs("(?i)foo") is None
+        # коды символов не дают своих цифр в подстроку
+        assert literal_runs(r"\x41bcd") == ["bcd"]
+        assert literal_runs(r"\101bcd") == ["bcd"]
+        assert literal_runs(r"\u0041bcd\N{DIGIT ONE}xyz") == ["bcd", "xyz"]
+        assert literal_runs(r"(a)\1xyz") == ["xyz"]
+
+    def test_grep_index_escapes(
+        self, search: SearchPlugin, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест: с индексом и без него grep находит одно и то же"""
+        fake_fs.create_file("/home/user/tg/a.txt", contents="Abcd\nxyz 1\n")
+        patterns = [r"\x41bcd", r"\101bcd", r"\u0041bc", r"\N{DIGIT ONE}", "xyz"]
+        plain = []
+        for pattern in patterns:
+            search.grep([pattern, "/home/user/tg", "-r"])
+            plain.append(capsys.readouterr().out)
+
+        search.index(["build", "/home/user/tg"])
+        capsys.readouterr()
+        for pattern, expected in zip(patterns, plain):
+            search.grep([pattern, "/home/user/tg", "-r"])
+            assert capsys.readouterr().out == expected
+            assert "a.txt" in expected
+
+    def test_grep_index(
+        self, search: SearchPlugin, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест отбора файлов по индексу триграмм"""
+        search.index(["build", "/home/user"])
+        assert "3 added" in capsys.readouterr().out
+
+        index = TrigramIndex.load("/home/user")
+        assert index is not None
+        candidates = index.candidates({int.from_bytes(b"nt1", "big")})
+        records = [index.files[i] for i in candidates]
+        assert records and all(record is not None for record in records)
+        assert [record[0] for record in records if record] == ["test1.txt"]
+        assert index.can_skip("/home/user/test2.txt", candidates)
+
+        # измененный после индексации файл проверяется полностью
+        with open("/home/user/test2.txt", "w") as f:
+            f.write("content1 again")
+        search.grep(["content1", "/home/user", "-r"])
+        output = capsys.readouterr().out
+        assert "/home/user/test1.txt:1: content1" in output
+        assert "/home/user/test2.txt:1: content1 again" in output
+
+        search.index(["update", "/home/user"])
+        assert "1 updated" in capsys.readouterr().out
+        search.index(["stats", "/home/user"])
+        assert "files: 3" in capsys.readouterr().out
+
+        with pytest.raises(Exception, match="Usage: index"):
+            search.index(["rebuild"])
+
     def test_grep_errors(self, search: SearchPlugin, fake_fs: FakeFilesystem) -> None:
         """Тест ошибок grep"""
         with pytest.raises(
             Exception, match=r"Usage: grep <pattern> <path> \[-r\] \[-i\]"
         ):
             search.grep(["abc"])
+        with pytest.raises(Exception, match="positive number of workers"):
+            search.grep(["abc", "/home/user", "-j", "0"])
+        with pytest.raises(Exception, match="Invalid size"):
+            search.grep(["abc", "/home/user", "--max-filesize", "big"])
 
 
 class TestHistoryPlugin:
@@ -80,12 +415,141 @@ class TestHistoryPlugin:
         args = ["-r", "documents"]
         backup_info = history.create_backup(args)
         monkeypatch.setattr("builtins.input", lambda _: "y")
-        terminal.rm(args)
+        terminal.rm(args, backup_info=backup_info)
         history.record_for_undo("rm", args, backup_info)
         assert not os.path.exists("/home/user/documents")
-        history.undo(args)
+        history.undo([])
         assert os.path.exists("/home/user/documents")
 
+    def test_rm_moves_to_trash(
+        self, terminal: Terminal, history: HistoryPlugin, fake_fs: FakeFilesystem
+    ) -> None:
+        """Тест корзины без повторного хранения одинаковых файлов"""
+        fake_fs.create_file("/home/user/copy.txt", contents="content1")
+        args = ["test1.txt", "copy.txt", "test2.txt"]
+        backup_info = history.create_backup(args)
+        os.remove("/home/user/test2.txt")
+        terminal.rm(["test1.txt", "copy.txt"], backup_info=backup_info)
+        history.record_for_undo("rm", args, backup_info)
+        assert len(history.undo_stack[-1]["backup_info"]) == 2
+        assert len(history.trash.load()["blobs"]) == 1
+        assert history.trash.usage() == len("content1")
+
+        history.undo([])
+        with open("/home/user/copy.txt") as f:
+            assert f.read() == "content1"
+        assert os.path.exists("/home/user/test1.txt")
+        assert not history.trash.load()["blobs"]
+
+    def test_undo_batch_and_redo(
+        self,
+        terminal: Terminal,
+        history: HistoryPlugin,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture[str],
+    ) -> None:
+        """Тест отмены нескольких операций и повтора"""
+        for i in range(3):
+            args = ["test1.txt", f"copy{i}.txt"]
+            terminal.cp(args)
+            history.record_for_undo("cp", args)
+        terminal.cd(["documents"])
+        backup_info = history.create_backup(["doc1.txt"])
+        terminal.rm(["doc1.txt"], backup_info=backup_info)
+        history.record_for_undo("rm", ["doc1.txt"], backup_info)
+
+        history.undo(["2"])
+        assert os.path.exists("/home/user/documents/doc1.txt")
+        assert os.path.exists("/home/user/copy1.txt")
+        assert not os.path.exists("/home/user/copy2.txt")
+        assert os.getcwd() == "/home/user/documents"
+
+        history.undo(["--to", "1"])
+        assert not os.path.exists("/home/user/copy0.txt")
+        assert [op["id"] for op in history.undo_journal.redo_stack] == [4, 3, 2, 1]
+
+        history.redo(["3"])
+        assert os.path.exists("/home/user/copy2.txt")
+        assert not os.path.exists("/home/user/copy3.txt")
+        restarted = UndoJournal(history.undo_file)
+        assert [op["id"] for op in restarted.stack] == [1, 2, 3]
+        assert [op["id"] for op in restarted.redo_stack] == [4]
+
+        history.redo([])
+        assert not os.path.exists("/home/user/documents/doc1.txt")
+        history.undo([])
+        assert os.path.exists("/home/user/documents/doc1.txt")
+
+        with pytest.raises(Exception, match="No operation with id 9"):
+            history.undo(["--to", "9"])
+        with pytest.raises(Exception, match="Usage: undo"):
+            history.undo(["-r", "documents"])
+
+    def test_trash_eviction(self, fake_fs: FakeFilesystem) -> None:
+        """Тест вытеснения старых объектов из корзины"""
+        trash = Trash("/home/user/.trash", max_bytes=10)
+        ids = []
+        for name in ("test1.txt", "test2.txt"):
+            path = f"/home/user/{name}"
+            trash_path = trash.reserve(path)
+            os.rename(path, trash_path)
+            ids.append(trash.store(trash_path, path))
+
+        assert trash.usage() == 8
+        with pytest.raises(Exception, match="no longer in trash"):
+            trash.restore(ids[0], "/home/user/test1.txt")
+        trash.restore(ids[1], "/home/user/test2.txt")
+        assert os.path.exists("/home/user/test2.txt")
+
+        # индекс переживает перезапуск
+        assert Trash("/home/user/.trash").load() == trash.load()
+
+    def test_trash_two_shells(self, fake_fs: FakeFilesystem) -> None:
+        """Тест корзины, которую делят две оболочки"""
+        first, second = Trash("/home/user/.trash"), Trash("/home/user/.trash")
+        ids = []
+        for trash, name in ((first, "test1.txt"), (second, "test2.txt")):
+            path = f"/home/user/{name}"
+            trash_path = trash.reserve(path)
+            os.rename(path, trash_path)
+            ids.append(trash.store(trash_path, path))
+
+        # запись второй оболочки не затерла запись первой
+        assert set(first.load()["entries"]) == set(ids)
+        first.restore(ids[1], "/home/user/test2.txt")
+        second.restore(ids[0], "/home/user/test1.txt")
+        assert os.path.exists("/home/user/test1.txt")
+        assert os.path.exists("/home/user/test2.txt")
+        assert not first.load()["entries"]
+
+    def test_trash_hashes_same_size_only(
+        self, fake_fs: FakeFilesystem, monkeypatch: MonkeyPatch
+    ) -> None:
+        """Тест хеширования в корзине только при совпадении размера"""
+        hashed: list[str] = []
+
+        def fake_hash(path: str) -> str:
+            hashed.append(path)
+            return "same"
+
+        monkeypatch.setattr("src.trash.file_hash", fake_hash)
+        fake_fs.create_file("/home/user/long.txt", contents="longer content")
+        trash = Trash("/home/user/.trash")
+        for name in ("test1.txt", "long.txt"):
+            path = f"/home/user/{name}"
+            trash_path = trash.reserve(path)
+            os.rename(path, trash_path)
+            trash.store(trash_path, path)
+        assert not hashed
+        assert len(trash.load()["blobs"]) == 2
+
+        # файл того же размера сравнивается по хешу с уже лежащим
+        trash_path = trash.reserve("/home/user/test2.txt")
+        os.rename("/home/user/test2.txt", trash_path)
+        trash.store(trash_path, "/home/user/test2.txt")
+        assert len(hashed) == 2
+        assert len(trash.load()["blobs"]) == 2
+
     def test_undo_cp(
         self, terminal: Terminal, history: HistoryPlugin, fake_fs: FakeFilesystem
     ) -> None:
@@ -96,7 +560,7 @@ class TestHistoryPlugin:
         history.record_for_undo("cp", args, backup_info)
         assert os.path.exists("/home/user/test1.txt")
         assert os.path.exists("/home/user/documents/test1.txt")
-        history.undo(args)
+        history.undo([])
         assert os.path.exists("/home/user/test1.txt")
         assert not os.path.exists("/home/user/documents/test1.txt")
 
@@ -110,6 +574,159 @@ class TestHistoryPlugin:
         history.record_for_undo("mv", args, backup_info)
         assert not os.path.exists("/home/user/test1.txt")
         assert os.path.exists("/home/user/documents/test1.txt")
-        history.undo(args)
+        history.undo([])
         assert os.path.exists("/home/user/test1.txt")
         assert not os.path.exists("/home/user/documents/test1.txt")
+
+
+class TestUndoJournal:
+    """Тест журнала отмены"""
+
+    def test_persistence(self, fake_fs: FakeFilesystem) -> None:
+        """Тест восстановления стека после перезапуска"""
+        journal = UndoJournal("/home/user/.undo")
+        journal.push({"command": "cp", "args": ["a", "b"]})
+        journal.push({"command": "mv", "args": ["c", "d"]})
+        assert journal.undo()[0]["command"] == "mv"
+
+        # оборванная при сбое запись не мешает восстановлению
+        with open("/home/user/.undo", "a") as f:
+            f.write('{"op": "pu')
+        restored = UndoJournal("/home/user/.undo")
+        assert [op["command"] for op in restored.stack] == ["cp"]
+        restored.push({"command": "rm", "args": ["e"]})
+        assert [op["id"] for op in UndoJournal("/home/user/.undo").stack] == [1, 3]
+
+    def test_two_shells(self, fake_fs: FakeFilesystem) -> None:
+        """Тест номеров операций, когда журнал делят две оболочки"""
+        first, second = UndoJournal("/home/user/.undo"), UndoJournal("/home/user/.undo")
+        first.push({"command": "cp", "args": ["a", "b"]})
+        second.push({"command": "mv", "args": ["c", "d"]})
+        first.push({"command": "rm", "args": ["e"]})
+        restored = UndoJournal("/home/user/.undo")
+        assert [op["id"] for op in restored.stack] == [1, 2, 3]
+        assert [op["command"] for op in restored.stack] == ["cp", "mv", "rm"]
+
+    def test_retention(self, fake_fs: FakeFilesystem) -> None:
+        """Тест ограничения размера журнала"""
+        journal = UndoJournal("/home/user/.undo", max_entries=2)
+        dropped = []
+        for i in range(10):
+            dropped += journal.push({"command": "cp", "args": [str(i)]})
+        assert [op["args"] for op in journal.stack] == [["8"], ["9"]]
+        assert len(dropped) == 8
+        with open("/home/user/.undo") as f:
+            assert len(f.readlines()) <= 6
+        assert UndoJournal("/home/user/.undo").stack == journal.stack
+
+    def test_undo_list(
+        self,
+        terminal: Terminal,
+        history: HistoryPlugin,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture[str],
+    ) -> None:
+        """Тест undo --list"""
+        history.undo(["--list"])
+        assert "No operations to undo" in capsys.readouterr().out
+        terminal.cp(["test1.txt", "copy.txt"])
+        history.record_for_undo("cp", ["test1.txt", "copy.txt"])
+        terminal.mv(["test2.txt", "moved.txt"])
+        history.record_for_undo("mv", ["test2.txt", "moved.txt"])
+        capsys.readouterr()
+        history.undo(["--list"])
+        assert capsys.readouterr().out.splitlines() == [
+            "   2  mv test2.txt moved.txt",
+            "   1  cp test1.txt copy.txt",
+        ]
+
+
+class TestHistoryJournal:
+    """Тест журнала истории"""
+
+    def test_append_batch(self, fake_fs: FakeFilesystem) -> None:
+        """Тест дозаписи пачками"""
+        journal = HistoryJournal("/home/user/.history", batch_size=3)
+        journal.append("ls")
+        journal.append("cd documents")
+        assert not os.path.exists("/home/user/.history")
+        journal.append("cat doc1.txt")
+        with open("/home/user/.history") as f:
+            assert f.read() == "ls\ncd documents\ncat doc1.txt\n"
+        journal.append("pwd")
+        journal.close()
+        with open("/home/user/.history") as f:
+            assert f.read().splitlines()[-1] == "pwd"
+
+    def test_policy_error(self, fake_fs: FakeFilesystem) -> None:
+        """Тест неизвестной политики сброса"""
+        with pytest.raises(Exception, match="Unknown fsync policy"):
+            HistoryJournal("/home/user/.history", fsync_policy="never")
+
+    def test_compact(self, fake_fs: FakeFilesystem) -> None:
+        """Тест сжатия журнала при превышении лимита"""
+        journal = HistoryJournal(
+            "/home/user/.history", fsync_policy="always", max_bytes=100
+        )
+        for i in range(50):
+            journal.append(f"echo {i}")
+        journal.compact()
+        journal.close()
+        with open("/home/user/.history") as f:
+            lines = f.read().splitlines()
+        assert os.path.getsize("/home/user/.history") <= 100
+        assert lines[-1] == "echo 49"
+        assert all(line.startswith("echo ") for line in lines)
+
+    def test_tail_from_index(self, fake_fs: FakeFilesystem) -> None:
+        """Тест чтения последних записей по индексу"""
+        journal = HistoryJournal("/home/user/.history", fsync_policy="always")
+        for i in range(10):
+            journal.append(f"echo {i}")
+        journal.close()
+        assert os.path.getsize("/home/user/.history.idx") == 10 * 8
+
+        journal = HistoryJournal("/home/user/.history")
+        assert len(journal) == 10
+        assert journal.tail(3) == ["echo 7", "echo 8", "echo 9"]
+        journal.append("ls")
+        assert journal.tail(2) == ["echo 9", "ls"]
+        assert list(journal.entries(8)) == ["echo 8", "echo 9", "ls"]
+
+    def test_index_catch_up(self, fake_fs: FakeFilesystem) -> None:
+        """Тест досчитывания индекса для старого файла истории"""
+        fake_fs.create_file("/home/user/.history", contents="ls\ncd ..\npwd")
+        journal = HistoryJournal("/home/user/.history", fsync_policy="always")
+        assert len(journal) == 3
+        journal.append("cat a.txt")
+        assert journal.tail(2) == ["pwd", "cat a.txt"]
+        with open("/home/user/.history") as f:
+            assert f.read() == "ls\ncd ..\npwd\ncat a.txt\n"
+
+    def test_two_shells(self, fake_fs: FakeFilesystem) -> None:
+        """Тест общего журнала двух оболочек"""
+        first = HistoryJournal("/home/user/.history", fsync_policy="always")
+        second = HistoryJournal("/home/user/.history", fsync_policy="always")
+        for i in (1, 2):
+            first.append(f"a{i}")
+            second.append(f"b{i}")
+
+        expected = ["a1", "b1", "a2", "b2"]
+        for journal in (first, second, HistoryJournal("/home/user/.history")):
+            assert len(journal) == 4
+            assert journal.tail(4) == expected
+            assert list(journal.entries()) == expected
+
+    def test_show_history(
+        self,
+        history: HistoryPlugin,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture[str],
+    ) -> None:
+        """Тест вывода последних команд"""
+        history.journal = HistoryJournal("/home/user/.history")
+        for command in ["ls", "cd documents", "cat doc1.txt"]:
+            history.add_command(command, [])
+        history.show_history(["2"])
+        output = capsys.readouterr().out.splitlines()
+        assert output == ["   2  cd documents", "   3  cat doc1.txt"]
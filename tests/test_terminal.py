@@ -1,10 +1,50 @@
+import inspect
+import io
+import json
+import logging
 import os
+import queue
+import subprocess
+import sys
+import time
+from importlib import metadata
 
+import pytest
 from pyfakefs.fake_filesystem import FakeFilesystem
-from pytest import CaptureFixture, MonkeyPatch
+from pytest import CaptureFixture, LogCaptureFixture, MonkeyPatch
 
+from src.logconfig import (
+    JsonFormatter,
+    LogQueueHandler,
+    RotatingLogHandler,
+    is_not_start,
+)
+from src.logger import error_message
+from src.main import Shell, split_commands
+from src.output import Output, output
+from src.plugins.archive import ArchivePlugin
+from src.registry import ARCHIVE, SEARCH, TERMINAL, CommandRegistry, CommandSpec
+from src.stats import Histogram
 from src.terminal import Terminal
 
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# сколько может занимать запуск оболочки, секунды: с большим запасом
+STARTUP_BUDGET = 1.5
+
+# модули, которые не должны загружаться до первой команды
+LAZY_MODULES = (
+    "src.plugins.archive",
+    "src.plugins.search",
+    "src.copier",
+    "src.logconfig",
+    "logging.handlers",
+    "importlib.metadata",
+    "zipfile",
+    "tarfile",
+    "concurrent.futures",
+)
+
 
 class TestLS:
     """Тест ls"""
@@ -40,6 +80,31 @@ class TestLS:
         assert " 0 " in lines[2]  # размер
         assert lines[2].endswith(" documents")
 
+    def test_ls_sort_and_hidden(
+        self, terminal: Terminal, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест ls -a, -S и -t"""
+        fake_fs.create_file("/home/user/.hidden", contents="x" * 20)
+        os.utime("/home/user/test2.txt", (0, 2000000000))
+        terminal.ls(["-aS"])
+        output = capsys.readouterr().out.split()
+        assert output[0] == ".hidden"
+        terminal.ls(["-t"])
+        output = capsys.readouterr().out.split()
+        assert output[0] == "test2.txt"
+        assert ".hidden" not in output
+
+    def test_ls_stream(
+        self, terminal: Terminal, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест потокового ls"""
+        terminal.ls(["--stream"])
+        assert capsys.readouterr().out == "test1.txt\ntest2.txt\ndocuments\n"
+        terminal.ls(["-l", "--stream", "documents"])
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 1
+        assert lines[0].endswith(" doc1.txt")
+
 
 class TestCD:
     """Тест cd"""
@@ -74,6 +139,26 @@ class TestCAT:
         assert output1 == "content1"
         assert output2 == "content2"
 
+    def test_cat_options(
+        self,
+        terminal: Terminal,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture[str],
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        """Тест cat -n и диапазона байт при чтении блоками"""
+        monkeypatch.setattr("src.terminal.CAT_CHUNK_SIZE", 4)
+        fake_fs.create_file("/home/user/lines.txt", contents="one\ntwo\nthree")
+        terminal.cat(["-n", "lines.txt"])
+        output = capsys.readouterr().out
+        assert output == "     1\tone\n     2\ttwo\n     3\tthree"
+        terminal.cat(["--range", "4-6", "lines.txt"])
+        assert capsys.readouterr().out == "two"
+        terminal.cat(["--range", "-5", "lines.txt"])
+        assert capsys.readouterr().out == "three"
+        with pytest.raises(Exception, match="Option --range requires a value"):
+            terminal.cat(["lines.txt", "--range"])
+
 
 class TestCP:
     """Тест cp"""
@@ -88,6 +173,18 @@ class TestCP:
         terminal.cp(["-r", "documents", "test_dir"])
         assert os.path.exists("/home/user/test_dir/doc1.txt")
 
+    def test_cp_tree(
+        self, terminal: Terminal, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест параллельного копирования дерева"""
+        for i in range(20):
+            fake_fs.create_file(f"/home/user/src/a/b{i % 3}/f{i}.txt", contents=str(i))
+        terminal.cp(["-r", "-v", "src", "dst"])
+        for i in range(20):
+            with open(f"/home/user/dst/a/b{i % 3}/f{i}.txt") as f:
+                assert f.read() == str(i)
+        assert "Copied 20 files" in capsys.readouterr().out
+
 
 class TestMV:
     """Тест mv"""
@@ -145,3 +242,239 @@ class TestRM:
         monkeypatch.setattr("builtins.input", lambda _: "y")
         terminal.rm(["-r", "documents"])
         assert not os.path.exists("/home/user/documents")
+
+
+class TestOutput:
+    """Тест буферизованного вывода"""
+
+    def test_buffering(self) -> None:
+        """Тест записи крупными блоками"""
+        stream = io.StringIO()
+        out = Output(stream, buffer_size=10)
+        out.line("abc")
+        assert stream.getvalue() == ""
+        out.line("defghij")
+        assert stream.getvalue() == "abc\ndefghij\n"
+        out.write("k")
+        out.flush()
+        assert stream.getvalue() == "abc\ndefghij\nk"
+
+    def test_capture(self, terminal: Terminal, fake_fs: FakeFilesystem) -> None:
+        """Тест перехвата вывода команды"""
+        with output.capture() as captured:
+            terminal.cat(["test1.txt"])
+        assert captured.getvalue() == "content1"
+
+    def test_broken_pipe(self) -> None:
+        """Тест закрытого канала"""
+
+        class BrokenStream(io.StringIO):
+            def write(self, text: str) -> int:
+                raise BrokenPipeError
+
+        out = Output(BrokenStream())
+        out.line("abc")
+        out.flush()
+        assert out.closed
+        out.line("def")
+        out.flush()
+
+
+class TestLogging:
+    """Тест фонового журнала"""
+
+    def test_rotation(self, fake_fs: FakeFilesystem) -> None:
+        """Тест ротации по размеру и по возрасту"""
+        handler = RotatingLogHandler("/home/user/shell.log", 50, 3600, 2)
+        for i in range(6):
+            handler.handle(logging.makeLogRecord({"msg": f"command number {i}"}))
+        assert os.path.exists("/home/user/shell.log.2")
+        assert not os.path.exists("/home/user/shell.log.3")
+
+        handler.rollover_at = 0
+        handler.handle(logging.makeLogRecord({"msg": "late"}))
+        handler.close()
+        with open("/home/user/shell.log") as f:
+            assert f.read() == "late\n"
+
+    def test_json_format(
+        self, terminal: Terminal, fake_fs: FakeFilesystem, caplog: LogCaptureFixture
+    ) -> None:
+        """Тест структурированных записей о командах"""
+        with caplog.at_level(logging.INFO):
+            terminal.ls(["documents"])
+            with pytest.raises(OSError, match="No such file or directory"):
+                terminal.cat(["missing.txt"])
+
+        records = [record for record in caplog.records if is_not_start(record)]
+        formatter = JsonFormatter()
+        ls_record, cat_record = (json.loads(formatter.format(r)) for r in records)
+        assert ls_record["command"] == "ls"
+        assert ls_record["args"] == ["documents"]
+        assert ls_record["cwd"] == "/home/user"
+        assert ls_record["status"] == "ok"
+        assert ls_record["error"] is None
+        assert cat_record["status"] == "error"
+        assert cat_record["error"] == "No such file or directory: 'missing.txt'"
+
+    def test_error_message(self) -> None:
+        """Тест текста ошибок без префикса [Errno N]"""
+        error = FileNotFoundError(2, "No such file or directory", "a.txt")
+        assert error_message(error) == "No such file or directory: 'a.txt'"
+        assert error_message(Exception("[x] y")) == "[x] y"
+
+    def test_queue_policy(self) -> None:
+        """Тест отбрасывания записей при переполнении очереди"""
+        log_queue: queue.Queue = queue.Queue(1)
+        handler = LogQueueHandler(log_queue, "drop")
+        for i in range(3):
+            handler.handle(logging.makeLogRecord({"msg": "rm %s", "args": (i,)}))
+        assert handler.dropped == 2
+        # запись форматируется уже в фоновом потоке
+        assert log_queue.get_nowait().args == (0,)
+
+        with pytest.raises(Exception, match="Unknown log policy"):
+            LogQueueHandler(log_queue, "wait")
+
+
+class TestStats:
+    """Тест статистики команд"""
+
+    def test_histogram(self) -> None:
+        """Тест перцентилей гистограммы"""
+        histogram = Histogram()
+        for i in range(1, 1001):
+            histogram.add(i / 1000)
+        assert 0.5 <= histogram.percentile(0.5) <= 0.55
+        assert 0.99 <= histogram.percentile(0.99) <= 1.0
+        assert histogram.percentile(1.0) == 1.0
+
+    def test_stats(
+        self, terminal: Terminal, fake_fs: FakeFilesystem, capsys: CaptureFixture[str]
+    ) -> None:
+        """Тест вывода статистики"""
+        terminal.ls([])
+        with pytest.raises(OSError, match="No such file or directory"):
+            terminal.cat(["missing.txt"])
+        capsys.readouterr()
+
+        terminal.stats(["--json"])
+        snapshot = json.loads(capsys.readouterr().out)
+        assert snapshot["ls"]["count"] >= 1
+        assert snapshot["cat"]["errors"] >= 1
+        assert set(snapshot["ls"]["wall_seconds"]) == {"p50", "p95", "p99"}
+
+        terminal.stats(["--prometheus"])
+        output = capsys.readouterr().out
+        assert 'shell_command_duration_seconds_count{command="ls"}' in output
+        assert "# TYPE shell_command_read_bytes_total counter" in output
+
+        with pytest.raises(Exception, match="Usage: stats"):
+            terminal.stats(["--xml"])
+
+
+class TestScript:
+    """Тест выполнения сценариев"""
+
+    def test_split_commands(self) -> None:
+        """Тест разбиения на команды"""
+        commands = list(split_commands("ls; cat 'a;b.txt'\ncd .."))
+        assert commands == ["ls", " cat 'a;b.txt'", "cd .."]
+
+    def test_run_script(
+        self,
+        fake_fs: FakeFilesystem,
+        capsys: CaptureFixture[str],
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        """Тест сценария с ошибкой и exit"""
+        # фоновый журнал в тестах не нужен
+        monkeypatch.setattr(Shell, "start_logging", lambda self: None)
+        shell = Shell(save_history=False)
+        shell.run_script(
+            ["cp test1.txt 'copy 1.txt'; nope\n", "# comment\n", "exit; rm test1.txt"]
+        )
+        assert os.path.exists("/home/user/copy 1.txt")
+        assert os.path.exists("/home/user/test1.txt")
+        assert shell.failed == 1
+        assert "ERROR: Unknown command: nope" in capsys.readouterr().out
+
+
+class TestRegistry:
+    """Тест таблицы команд"""
+
+    def test_lazy_handlers(self, terminal: Terminal) -> None:
+        """Тест создания исполнителей при первом вызове"""
+        registry = CommandRegistry(terminal.logger, {TERMINAL: terminal})
+        rm, mv, ls, zip_spec, unzip = map(
+            registry.get, ["rm", "mv", "ls", "zip", "unzip"]
+        )
+        assert rm is not None and rm.needs_backup
+        assert mv is not None and mv.undoable
+        assert ls is not None and not ls.undoable
+        assert registry.handler(ls) == terminal.ls
+
+        assert zip_spec is not None and unzip is not None
+        zip_handler = registry.handler(zip_spec)
+        assert inspect.ismethod(zip_handler)
+        plugin = getattr(zip_handler, "__self__", None)
+        assert isinstance(plugin, ArchivePlugin)
+        assert registry.handler(unzip) == plugin.unzip
+
+    def test_shared_plugins(self, fake_fs: FakeFilesystem) -> None:
+        """Тест общих с терминалом плагинов"""
+        shell = Shell(save_history=False)
+        registry, terminal = shell.registry, shell.terminal
+        tar, grep = registry.get("tar"), registry.get("grep")
+        assert tar is not None and grep is not None
+        assert registry.handler(tar) == terminal.archive_plugin.tar
+        assert registry.handler(grep) == terminal.search_plugin.grep
+        assert registry.instance(ARCHIVE) is terminal.archive_plugin
+
+    def test_entry_points(self, terminal: Terminal, monkeypatch: MonkeyPatch) -> None:
+        """Тест команд из точек входа"""
+        entry_points = [
+            metadata.EntryPoint("find", "src.plugins.search:SearchPlugin.grep", ""),
+            metadata.EntryPoint("ls", "src.plugins.search:SearchPlugin.grep", ""),
+            metadata.EntryPoint("broken", "src.plugins.search", ""),
+        ]
+        monkeypatch.setattr(metadata, "entry_points", lambda group: entry_points)
+        registry = CommandRegistry(terminal.logger, {TERMINAL: terminal})
+
+        assert registry.get("find") == CommandSpec("find", SEARCH, "grep")
+        ls = registry.get("ls")
+        assert ls is not None and ls.owner == TERMINAL
+        assert registry.get("broken") is None
+
+
+class TestStartup:
+    """Тест времени запуска оболочки"""
+
+    def test_lazy_imports(self) -> None:
+        """Тест импорта без плагинов, журнала и тяжелых модулей"""
+        code = (
+            "import logging, sys, src.main\n"
+            "assert not logging.getLogger().handlers\n"
+            f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == ""
+
+    def test_startup_budget(self) -> None:
+        """Тест холодного запуска в пределах бюджета"""
+        best = float("inf")
+        for _ in range(3):
+            started = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-m", "src.main", "--no-history", "-c", "exit"],
+                cwd=ROOT_DIR,
+                check=True,
+            )
+            best = min(best, time.perf_counter() - started)
+        assert best < STARTUP_BUDGET
@@ -14,6 +14,13 @@ class TestLSErrors:
         with pytest.raises(Exception, match="Too many arguments"):
             terminal.ls(["/home", "/home/user"])
 
+    def test_ls_bad_options(self, terminal: Terminal, fake_fs: FakeFilesystem) -> None:
+        """Тест неверные ключи ls"""
+        with pytest.raises(Exception, match="Unknown option: -x"):
+            terminal.ls(["-lx"])
+        with pytest.raises(Exception, match="cannot be combined"):
+            terminal.ls(["-S", "--stream"])
+
     def test_ls_invalid_path(self, terminal: Terminal, fake_fs: FakeFilesystem) -> None:
         """Тест неверный путь ls"""
         with pytest.raises(Exception, match="No such file or directory"):
@@ -61,6 +68,11 @@ class TestCATErrors:
         with pytest.raises(Exception, match="Is a directory"):
             terminal.cat(["documents"])
 
+    def test_cat_bad_range(self, terminal: Terminal, fake_fs: FakeFilesystem) -> None:
+        """Тест неверный диапазон байт"""
+        with pytest.raises(Exception, match="Invalid range"):
+            terminal.cat(["--range", "5-1", "test1.txt"])
+
 
 class TestCPErrors:
     """Тест ошибок cp"""